@@ -0,0 +1,238 @@
+import os
+import math
+import time
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# 请求优先级，数值越小优先级越高
+PRIORITIES = {
+    "interactive": 0,  # 前端页面的交互式查询
+    "batch": 1         # 批量任务
+}
+DEFAULT_PRIORITY = "interactive"
+
+# 当前线程的请求上下文（客户端标识和优先级）
+_request_context = threading.local()
+
+class AdmissionRejected(Exception):
+    """排队等待预计超过期限或队列已满时拒绝请求"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+@contextmanager
+def request_context(client_id=None, priority=None):
+    """
+    设置当前线程的请求上下文，供LLM调用时的准入控制使用
+
+    Args:
+        client_id (str, optional): 客户端标识，用于同优先级内的公平调度
+        priority (str, optional): 优先级名称，interactive或batch
+    """
+    previous = getattr(_request_context, "value", None)
+    _request_context.value = (client_id, priority)
+    try:
+        yield
+    finally:
+        _request_context.value = previous
+
+def get_request_context():
+    """获取当前线程的请求上下文，返回(client_id, priority)"""
+    return getattr(_request_context, "value", None) or (None, None)
+
+class _Waiter:
+    __slots__ = ("granted",)
+
+    def __init__(self):
+        self.granted = False
+
+class AdmissionController:
+    def __init__(self, max_concurrency=None, max_queue=None, max_queue_per_client=None, deadline=None):
+        """
+        初始化LLM调用的准入控制器
+
+        Args:
+            max_concurrency (int, optional): 同时进行的LLM调用上限，默认读取LLM_MAX_CONCURRENCY
+            max_queue (int, optional): 等待队列长度上限，默认读取LLM_MAX_QUEUE
+            max_queue_per_client (int, optional): 单个客户端的排队上限，默认读取LLM_MAX_QUEUE_PER_CLIENT
+            deadline (float, optional): 排队等待期限（秒），默认读取LLM_QUEUE_DEADLINE
+        """
+        self.max_concurrency = max_concurrency or int(os.environ.get("LLM_MAX_CONCURRENCY", "2"))
+        self.max_queue = max_queue or int(os.environ.get("LLM_MAX_QUEUE", "32"))
+        self.max_queue_per_client = max_queue_per_client or int(os.environ.get("LLM_MAX_QUEUE_PER_CLIENT", "8"))
+        self.deadline = deadline or float(os.environ.get("LLM_QUEUE_DEADLINE", "30"))
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        # 每个优先级一个队列：客户端标识 -> 等待者队列，客户端之间轮转调度
+        self._queues = {priority: OrderedDict() for priority in sorted(PRIORITIES.values())}
+        self._queued = 0
+        # 单次LLM调用耗时的滑动平均，用于估算排队时间
+        self._avg_service_time = float(os.environ.get("LLM_INITIAL_SERVICE_TIME", "5"))
+
+        # 指标
+        self._admitted = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._wait_times = deque(maxlen=1000)
+
+    @contextmanager
+    def slot(self, client_id=None, priority=None):
+        """
+        占用一个LLM调用名额，退出时释放
+
+        未指定client_id和priority时使用当前线程的请求上下文。
+
+        Raises:
+            AdmissionRejected: 预计等待超过期限、队列已满或等待超时
+        """
+        if client_id is None and priority is None:
+            client_id, priority = get_request_context()
+        self.acquire(client_id, priority)
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.release(time.time() - start)
+
+    def acquire(self, client_id=None, priority=None):
+        """获取LLM调用名额，必要时排队等待"""
+        client_id = client_id or "anonymous"
+        level = PRIORITIES.get(priority or DEFAULT_PRIORITY, PRIORITIES[DEFAULT_PRIORITY])
+        start = time.time()
+
+        with self._cond:
+            if self._in_flight < self.max_concurrency and self._queued == 0:
+                self._in_flight += 1
+                self._admitted += 1
+                self._wait_times.append(0.0)
+                return
+
+            queue = self._queues[level]
+            waiters = queue.get(client_id)
+            if self._queued >= self.max_queue or (waiters and len(waiters) >= self.max_queue_per_client):
+                self._reject("LLM请求队列已满")
+
+            estimated_wait = self._estimate_wait(level)
+            if estimated_wait > self.deadline:
+                self._reject(f"预计排队时间 {estimated_wait:.1f}s 超过期限", estimated_wait)
+
+            waiter = _Waiter()
+            if waiters is None:
+                waiters = queue[client_id] = deque()
+            waiters.append(waiter)
+            self._queued += 1
+
+            expires_at = start + self.deadline
+            while not waiter.granted:
+                remaining = expires_at - time.time()
+                if remaining <= 0:
+                    self._remove_waiter(level, client_id, waiter)
+                    self._timeouts += 1
+                    self._reject("等待LLM调用超时")
+                self._cond.wait(remaining)
+
+            self._admitted += 1
+            self._wait_times.append(time.time() - start)
+
+    def release(self, service_time=None):
+        """释放LLM调用名额，并唤醒下一个等待者"""
+        with self._cond:
+            self._in_flight -= 1
+            if service_time is not None:
+                self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * service_time
+            self._dispatch()
+
+    def _dispatch(self):
+        """按优先级从高到低、同优先级内按客户端轮转分配空闲名额"""
+        granted = False
+        while self._in_flight < self.max_concurrency and self._queued > 0:
+            for queue in self._queues.values():
+                if queue:
+                    break
+            client_id, waiters = next(iter(queue.items()))
+            waiter = waiters.popleft()
+            # 已服务的客户端移到队尾，让其他客户端先被调度
+            if waiters:
+                queue.move_to_end(client_id)
+            else:
+                del queue[client_id]
+            self._queued -= 1
+            self._in_flight += 1
+            waiter.granted = True
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _remove_waiter(self, level, client_id, waiter):
+        waiters = self._queues[level].get(client_id)
+        if waiters is None or waiter not in waiters:
+            return
+        waiters.remove(waiter)
+        if not waiters:
+            del self._queues[level][client_id]
+        self._queued -= 1
+
+    def _estimate_wait(self, level):
+        """估算新请求的排队时间：排在前面的请求数 / 并发数 * 平均耗时"""
+        ahead = sum(
+            len(waiters)
+            for priority, queue in self._queues.items() if priority <= level
+            for waiters in queue.values()
+        )
+        return (ahead + 1) / self.max_concurrency * self._avg_service_time
+
+    def _reject(self, message, estimated_wait=None):
+        self._rejected += 1
+        retry_after = max(1, math.ceil(estimated_wait if estimated_wait is not None else self._avg_service_time))
+        raise AdmissionRejected(message, retry_after)
+
+    def get_metrics(self):
+        """
+        获取准入控制指标
+
+        Returns:
+            dict: 并发数、队列深度、排队耗时等指标
+        """
+        with self._cond:
+            wait_times = sorted(self._wait_times)
+            queue_depth = {
+                name: sum(len(waiters) for waiters in self._queues[level].values())
+                for name, level in PRIORITIES.items()
+            }
+            metrics = {
+                "max_concurrency": self.max_concurrency,
+                # 上限和队列只在当前进程内生效
+                "pid": os.getpid(),
+                "in_flight": self._in_flight,
+                "queue_depth": self._queued,
+                "queue_depth_by_priority": queue_depth,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "timeouts": self._timeouts,
+                "avg_service_time": round(self._avg_service_time, 3),
+                "estimated_wait": round(self._estimate_wait(max(PRIORITIES.values())), 3)
+            }
+
+        if wait_times:
+            metrics["wait_time_avg"] = round(sum(wait_times) / len(wait_times), 3)
+            metrics["wait_time_p95"] = round(wait_times[min(len(wait_times) - 1, int(len(wait_times) * 0.95))], 3)
+        return metrics
+
+_default_controller = None
+_default_controller_lock = threading.Lock()
+
+def get_admission_controller():
+    """
+    获取进程内共享的准入控制器，所有LLM客户端共用同一个Ollama服务
+
+    控制器不跨进程协调，多worker部署时每个worker各有一份并发上限和等待队列。
+    """
+    global _default_controller
+    if _default_controller is None:
+        with _default_controller_lock:
+            if _default_controller is None:
+                _default_controller = AdmissionController()
+    return _default_controller
@@ -1,7 +1,22 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 import os
-from sql_generator import SQLGenerator
+import time
+import threading
+from sql_generator import SQLGenerator, READ_ONLY_SQL_PATTERN
 from java_api_client import JavaAPIClient
+from warmup import WarmupManager, get_warmup_queries
+from admission_control import AdmissionRejected, get_admission_controller, request_context
+from speculative_execution import SpeculativeExecutor
+from result_cache import get_data_version
+from shared_cache import get_cache, make_cache_key
+from response_encoding import compute_etag, make_compact_response
+from profiling import QueryProfiler, render_profile, is_admin_request
+from result_export import EXPORT_FORMATS, iter_csv, iter_parquet, use_parquet
+from java_api_client import JavaAPIError
+from indicator_engine import IndicatorEngine, InvalidExpression, describe_primitives, use_numpy
+from query_log import QueryLog
+from prewarm import PrewarmScheduler
+from job_manager import JobManager, JOB_SUCCEEDED
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -10,18 +25,246 @@ load_dotenv()
 # 创建Flask应用
 app = Flask(__name__)
 
-# 创建模块实例
-sql_generator = SQLGenerator()
-java_api_client = JavaAPIClient()
+# 模块实例在首次使用时创建，避免导入时阻塞
+_components = {}
+# 创建实例时可能依赖其他实例，使用可重入锁
+_components_lock = threading.RLock()
+
+def get_component(name, factory):
+    """获取模块实例，不存在时创建"""
+    if name not in _components:
+        with _components_lock:
+            if name not in _components:
+                _components[name] = factory()
+    return _components[name]
+
+def get_sql_generator():
+    return get_component('sql_generator', SQLGenerator)
+
+def get_java_api_client():
+    return get_component('java_api_client', JavaAPIClient)
+
+def get_speculative_executor():
+    return get_component('speculative_executor', lambda: SpeculativeExecutor(get_java_api_client().execute_sql))
+
+def get_indicator_engine():
+    # 字段别名由SQLGenerator登记到表结构注册表，先创建SQLGenerator
+    get_sql_generator()
+    return get_component('indicator_engine', lambda: IndicatorEngine(get_java_api_client()))
+
+def get_query_cache():
+    """查询结果缓存：(数据版本, 用户查询) -> 响应内容和ETag，CACHE_BACKEND为none时为None"""
+    return get_component('query_cache', lambda: get_cache(
+        'query',
+        ttl=int(os.environ.get('QUERY_CACHE_TTL', 28800)),
+        max_entries=int(os.environ.get('QUERY_CACHE_MAX_ENTRIES', 1000))
+    ))
+
+def get_query_log():
+    return get_component('query_log', QueryLog)
+
+def get_prewarm_scheduler():
+    return get_component('prewarm_scheduler', lambda: PrewarmScheduler(
+        get_java_api_client(),
+        get_query_log(),
+        on_result=lambda user_query, sql, result: cache_query_payload(user_query, {'sql': sql, 'result': result}),
+        claim_cache=get_cache('prewarm', ttl=7 * 86400)
+    ))
+
+def get_job_manager():
+    return get_component('job_manager', lambda: JobManager(
+        result_cache=get_cache('job', ttl=float(os.environ.get('JOB_RESULT_TTL', 3600)))
+    ))
+
+def cache_query_payload(user_query, payload):
+    """按（数据版本, 查询）缓存执行成功的响应内容，返回ETag"""
+    etag = compute_etag(payload)
+    query_cache = get_query_cache()
+    if query_cache is not None:
+        query_cache.set(make_cache_key(get_data_version(), user_query.strip()), {'payload': payload, 'etag': etag})
+    return etag
+
+def log_query(user_query, payload):
+    """记录查询及其SQL，用于新交易日数据到达后预热常用查询；指标引擎的查询不记录"""
+    if 'indicator' in payload:
+        return
+    try:
+        get_query_log().record(user_query, payload['sql'])
+    except Exception as e:
+        print(f"记录查询日志时出错: {e}")
+
+# 按需性能分析
+query_profiler = QueryProfiler()
+
+# 启动预热
+warmup_manager = WarmupManager()
+
+def _preload_model():
+    return get_sql_generator().preload_models()
+
+def _build_indexes():
+    get_sql_generator().build_indexes()
+    get_java_api_client()
+
+def _run_warmup_queries():
+    ok = True
+    for warmup_query in get_warmup_queries():
+        start = time.time()
+        sql = get_sql_generator().generate_sql(warmup_query)
+        result = get_java_api_client().execute_sql(sql)
+        print(f"预热查询 {warmup_query} 耗时 {time.time() - start:.2f}s")
+        if result.get('code') != 0:
+            ok = False
+    return ok
+
+warmup_manager.add_step('preload_model', _preload_model, required=True)
+warmup_manager.add_step('build_indexes', _build_indexes)
+warmup_manager.add_step('warmup_queries', _run_warmup_queries)
 
 @app.route('/')
 def index():
     """渲染首页"""
     return render_template('index.html')
 
+@app.route('/ready')
+def ready():
+    """就绪检查，预热完成前返回503，负载均衡据此决定是否转发流量"""
+    status = warmup_manager.get_status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/metrics')
+def metrics():
+    """运行指标"""
+    return jsonify({
+        'llm_admission': get_admission_controller().get_metrics(),
+        'speculation': get_speculative_executor().get_metrics(),
+        'query_cache': get_query_cache().get_metrics() if get_query_cache() is not None else None,
+        'query_log': get_query_log().get_metrics(),
+        'prewarm': get_prewarm_scheduler().get_status(),
+        'jobs': get_job_manager().get_metrics(),
+        'model_routing': get_sql_generator().router.get_metrics()
+    })
+
+def get_client_context(data=None):
+    """
+    获取请求的客户端标识和优先级
+    
+    客户端标识优先取X-Client-Id请求头，其次为来源IP；优先级取X-Priority请求头或请求体中的priority字段。
+    """
+    client_id = request.headers.get('X-Client-Id') or request.headers.get('X-Forwarded-For', request.remote_addr or '').split(',')[0].strip()
+    priority = request.headers.get('X-Priority') or (data or {}).get('priority')
+    return client_id, priority
+
+def overloaded_response(error):
+    """准入控制拒绝请求时快速返回503"""
+    response = jsonify({
+        'error': f'服务繁忙，请稍后重试: {str(error)}'
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@app.route('/admin/profiles')
+def list_profiles():
+    """列出最近的性能分析结果"""
+    if not is_admin_request():
+        return jsonify({'error': '无权访问'}), 403
+    return jsonify({'profiles': query_profiler.list_profiles()})
+
+@app.route('/admin/profiles/<profile_id>')
+def download_profile(profile_id):
+    """下载性能分析结果，cProfile结果可通过format=text查看文本报告"""
+    if not is_admin_request():
+        return jsonify({'error': '无权访问'}), 403
+    profile = query_profiler.get_profile(profile_id)
+    if profile is None:
+        return jsonify({'error': '分析结果不存在或已被淘汰'}), 404
+    
+    content, mimetype, extension = render_profile(profile, request.args.get('format'))
+    response = Response(content, mimetype=mimetype)
+    if extension != 'txt':
+        response.headers['Content-Disposition'] = f'attachment; filename={profile_id}.{extension}'
+    return response
+
+@app.route('/admin/prewarm', methods=['POST'])
+def trigger_prewarm():
+    """立即在后台预热当前数据版本的常用查询"""
+    if not is_admin_request():
+        return jsonify({'error': '无权访问'}), 403
+    scheduler = get_prewarm_scheduler()
+    threading.Thread(target=scheduler.run, name='prewarm-manual', daemon=True).start()
+    return jsonify(scheduler.get_status()), 202
+
+def run_query(user_query, client_id=None, priority=None, stage=None):
+    """
+    执行查询流水线：结果缓存 -> 指标引擎或SQL生成 -> 执行
+    
+    Args:
+        user_query (str): 用户的自然语言查询
+        client_id (str, optional): 客户端标识，用于LLM准入控制
+        priority (str, optional): 优先级，interactive或batch
+        stage (callable, optional): 每个阶段开始时以阶段名调用，用于记录各阶段耗时
+        
+    Returns:
+        tuple: (响应内容, ETag)，执行失败的结果ETag为None
+    """
+    stage = stage or (lambda name: None)
+    
+    # 同一数据版本（交易日）内的重复查询直接返回缓存结果
+    stage('cache_lookup')
+    query_cache = get_query_cache()
+    cache_key = make_cache_key(get_data_version(), user_query.strip())
+    cached = query_cache.get(cache_key) if query_cache is not None else None
+    if cached is not None:
+        log_query(user_query, cached['payload'])
+        return cached['payload'], cached['etag']
+    
+    # 跨交易日条件（连续N天、N日内金叉等）由指标引擎在多日数据上计算，不经过LLM
+    expression = get_sql_generator().indicator_expression(user_query)
+    if expression is not None:
+        stage('indicator')
+        sql, result = get_indicator_engine().screen(expression)
+    else:
+        # LLM生成期间预先执行候选SQL
+        speculative_executor = get_speculative_executor()
+        speculation = speculative_executor.submit(get_sql_generator().speculative_candidate(user_query))
+        
+        # 生成SQL，出错（如准入控制拒绝）时放弃预执行，避免在过载时继续给Java API增加负载
+        stage('generate_sql')
+        try:
+            with request_context(client_id, priority):
+                sql = get_sql_generator().generate_sql(user_query)
+        except BaseException:
+            speculative_executor.abandon(speculation)
+            raise
+        
+        # 最终SQL与候选一致时直接使用预执行结果，否则调用Java API执行SQL
+        stage('execute_sql')
+        result = speculative_executor.resolve(speculation, sql)
+        if result is None:
+            result = get_java_api_client().execute_sql(sql)
+    
+    # 只缓存执行成功的结果
+    payload = {
+        'sql': sql,
+        'result': result
+    }
+    if expression is not None:
+        payload['indicator'] = expression
+    etag = None
+    if result.get('code') == 0:
+        etag = cache_query_payload(user_query, payload)
+        log_query(user_query, payload)
+    elif expression is None:
+        # 执行失败的SQL（如LLM编造的字段）不再复用，下次重新生成
+        get_sql_generator().forget_sql(user_query)
+    return payload, etag
+
 @app.route('/query', methods=['POST'])
+@query_profiler.profiled('query')
 def query():
     """处理用户查询请求"""
+    start = time.time()
     try:
         # 获取用户输入
         data = request.get_json()
@@ -32,21 +275,172 @@ def query():
                 'error': '查询内容不能为空'
             }), 400
         
-        # 生成SQL
-        sql = sql_generator.generate_sql(user_query)
-        
-        # 调用Java API执行SQL
-        result = java_api_client.execute_sql(sql)
-        
-        # 返回结果
+        payload, etag = run_query(user_query, *get_client_context(data))
+        warmup_manager.record_response(time.time() - start)
+        # ETag一致时返回304
+        return make_compact_response(payload, etag)
+    
+    except AdmissionRejected as e:
+        return overloaded_response(e)
+    except InvalidExpression as e:
+        # 跨交易日条件超出支持范围，如窗口超过INDICATOR_MAX_DAYS
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
         return jsonify({
-            'sql': sql,
-            'result': result
+            'error': f'处理查询时出错: {str(e)}'
+        }), 500
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    以后台任务方式提交查询，立即返回任务编号，适合Java端执行时间较长的查询
+    
+    相同查询的任务未完成时直接返回该任务；后台任务默认使用batch优先级。
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        user_query = data.get('query', '')
+        if not user_query:
+            return jsonify({
+                'error': '查询内容不能为空'
+            }), 400
+        
+        client_id, priority = get_client_context(data)
+        priority = priority or 'batch'
+        key = make_cache_key(get_data_version(), user_query.strip())
+        snapshot, attached = get_job_manager().submit(
+            key,
+            user_query,
+            lambda job: run_query(user_query, client_id, priority, stage=job.stage)[0]
+        )
+        job_id = snapshot['job_id']
+        response = jsonify({
+            'job_id': job_id,
+            'status': snapshot['status'],
+            'attached': attached,
+            'status_url': f'/jobs/{job_id}'
         })
+        response.status_code = 202
+        response.headers['Location'] = f'/jobs/{job_id}'
+        return response
     
+    except AdmissionRejected as e:
+        return overloaded_response(e)
     except Exception as e:
         return jsonify({
-            'error': f'处理查询时出错: {str(e)}'
+            'error': f'提交任务时出错: {str(e)}'
+        }), 500
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """查询后台任务的状态、各阶段耗时，完成后返回sql和result"""
+    snapshot = get_job_manager().get(job_id)
+    if snapshot is None:
+        return jsonify({'error': '任务不存在或结果已过期'}), 404
+    # 已完成任务的状态不再变化，按内容计算ETag，ETag一致时返回304
+    return make_compact_response(snapshot, compute_etag(snapshot) if snapshot['status'] == JOB_SUCCEEDED else None)
+
+@app.route('/indicators')
+def list_indicators():
+    """列出指标引擎支持的基本运算和可用字段"""
+    if not use_numpy:
+        return jsonify({'error': '服务端未安装numpy，指标引擎不可用'}), 501
+    return jsonify({
+        'primitives': describe_primitives(),
+        'fields': get_indicator_engine().numeric_fields()
+    })
+
+@app.route('/indicators/screen', methods=['POST'])
+def screen_indicators():
+    """
+    按表达式筛选股票
+    
+    请求体：{"expression": ["within", ["cross_above", "factor_macd_dif", "factor_macd_dea"], 5]}
+    """
+    if not use_numpy:
+        return jsonify({'error': '服务端未安装numpy，指标引擎不可用'}), 501
+    try:
+        data = request.get_json(silent=True) or {}
+        expression = data.get('expression')
+        if not expression:
+            return jsonify({'error': '表达式不能为空'}), 400
+        sql, result = get_indicator_engine().screen(expression)
+        return make_compact_response({'sql': sql, 'indicator': expression, 'result': result})
+    except InvalidExpression as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({
+            'error': f'指标筛选时出错: {str(e)}'
+        }), 500
+
+@app.route('/query/export', methods=['GET', 'POST'])
+def export_query():
+    """
+    流式导出查询结果
+    
+    参数（查询参数或JSON请求体）：query为自然语言查询，或sql为SELECT语句（需要管理令牌，只能查询已登记的表）；
+    format为csv（默认）或parquet。自然语言查询与/query的处理方式一致，跨交易日条件由指标引擎计算。
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        params = request.args.to_dict()
+        params.update(data)
+        user_query = params.get('query', '')
+        sql = params.get('sql', '')
+        fmt = params.get('format', 'csv')
+        expression = None
+        
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'error': f'不支持的导出格式: {fmt}'}), 400
+        if fmt == 'parquet' and not use_parquet:
+            return jsonify({'error': '服务端未安装pyarrow，无法导出Parquet'}), 400
+        if not user_query and not sql:
+            return jsonify({'error': '查询内容不能为空'}), 400
+        if sql:
+            if not is_admin_request():
+                return jsonify({'error': '直接导出SQL需要管理令牌'}), 403
+            if not READ_ONLY_SQL_PATTERN.match(sql) or not get_sql_generator().validate_sql(sql):
+                return jsonify({'error': '只允许导出查询已登记表的单条SELECT语句'}), 400
+        
+        if not sql:
+            expression = get_sql_generator().indicator_expression(user_query)
+        if expression is not None:
+            # 跨交易日条件与/query一样由指标引擎计算，结果已在内存中
+            sql, result = get_indicator_engine().screen(expression)
+            if result.get('code') != 0:
+                raise JavaAPIError(result.get('msg', 'SQL执行失败'))
+            rows = iter(result.get('data') or [])
+        else:
+            if not sql:
+                with request_context(*get_client_context(data)):
+                    sql = get_sql_generator().generate_sql(user_query)
+            rows = get_java_api_client().stream_sql(sql)
+        
+        # 先取第一行，执行失败时还能返回错误状态码
+        first_row = next(rows, None)
+        
+        def all_rows():
+            if first_row is not None:
+                yield first_row
+                yield from rows
+        
+        encoder = iter_parquet if fmt == 'parquet' else iter_csv
+        mimetype, extension = EXPORT_FORMATS[fmt]
+        response = Response(stream_with_context(encoder(all_rows())), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename=export_{time.strftime("%Y%m%d_%H%M%S")}.{extension}'
+        return response
+    
+    except AdmissionRejected as e:
+        return overloaded_response(e)
+    except InvalidExpression as e:
+        return jsonify({'error': str(e)}), 400
+    except JavaAPIError as e:
+        if user_query and not params.get('sql') and expression is None:
+            get_sql_generator().forget_sql(user_query)
+        return jsonify({'error': str(e), 'sql': sql}), 502
+    except Exception as e:
+        return jsonify({
+            'error': f'导出查询结果时出错: {str(e)}'
         }), 500
 
 # 创建templates目录，如果不存在
@@ -55,6 +449,11 @@ def create_template_dir():
     if not os.path.exists(templates_dir):
         os.makedirs(templates_dir)
 
+def start_background_tasks():
+    """启动后台任务（启动预热、新交易日数据的缓存预热）"""
+    warmup_manager.start()
+    get_prewarm_scheduler().start()
+
 if __name__ == '__main__':
     create_template_dir()
     
@@ -62,4 +461,11 @@ if __name__ == '__main__':
     port = int(os.environ.get('FLASK_PORT', 5050))
     debug = os.environ.get('FLASK_DEBUG', 'True').lower() == 'true'
     
-    app.run(debug=debug, host='0.0.0.0', port=port) 
\ No newline at end of file
+    # debug模式下只在实际提供服务的子进程中启动后台任务
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_tasks()
+    
+    app.run(debug=debug, host='0.0.0.0', port=port)
+else:
+    # 通过WSGI服务器加载时直接启动后台任务
+    start_background_tasks()
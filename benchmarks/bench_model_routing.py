@@ -0,0 +1,112 @@
+"""
+模型路由基准测试：比较所有查询都使用大模型与按复杂度路由（简单查询使用小模型，校验失败升级到大模型）的延迟和准确率
+
+准确率：指定--java-api时比较执行结果是否与参考SQL一致，否则比较规范化后的WHERE/ORDER BY/LIMIT部分是否一致。
+语料中的simple/complex标注与复杂度权重是一起编写的，--classify-only的一致率只用于检查分类是否符合预期，
+不能代替在真实模型上测得的延迟和准确率。
+
+用法：
+    python benchmarks/bench_model_routing.py --classify-only
+    python benchmarks/bench_model_routing.py --modes large routed --java-api http://localhost:8082/system/llm/execute
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 基准测试不使用缓存
+os.environ["CACHE_BACKEND"] = "none"
+
+from llm_client import LLMClient, LLMProvider
+from sql_generator import SQLGenerator
+from sql_canonical import canonicalize_sql
+from query_router import TIER_SMALL
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "routing_corpus.jsonl")
+TAIL_PATTERN = re.compile(r'\bWHERE\b.*|\bORDER\s+BY\b.*|\bLIMIT\b.*', re.IGNORECASE | re.DOTALL)
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def sql_tail(sql):
+    """WHERE及之后的部分，忽略SELECT字段列表的差异"""
+    match = TAIL_PATTERN.search(sql or "")
+    return canonicalize_sql("SELECT * FROM t " + match.group(0) if match else "SELECT * FROM t")
+
+def result_key(result):
+    rows = result.get("data") or []
+    return result.get("code"), sorted(json.dumps(row, sort_keys=True, ensure_ascii=False) for row in rows)
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0
+
+def classify_only(generator, corpus):
+    agree = 0
+    for item in corpus:
+        tier, score, features = generator.router.classify(item["query"], generator.referenced_fields(item["query"]))
+        expected = TIER_SMALL if item["complexity"] == "simple" else "large"
+        agree += tier == expected
+        print(f"{tier:5s} {score:4.1f} {'✓' if tier == expected else '✗'} {item['query']}")
+    print(f"\n与标注一致: {agree}/{len(corpus)}（标注与权重一起编写，不代表路由后的准确率）")
+
+def run_mode(generator, corpus, mode, java_client, expected_results):
+    generator.router.enabled = mode == "routed"
+    latencies = []
+    correct = {"simple": [0, 0], "complex": [0, 0]}
+    for item in corpus:
+        start = time.time()
+        sql = generator.generate_sql(item["query"])
+        latencies.append(time.time() - start)
+        if java_client:
+            ok = result_key(java_client.execute_sql(sql, use_cache=False)) == expected_results[item["query"]]
+        else:
+            ok = sql_tail(sql) == sql_tail(item["sql"])
+        correct[item["complexity"]][0] += ok
+        correct[item["complexity"]][1] += 1
+
+    total_correct = sum(c for c, _ in correct.values())
+    print(f"\n== {mode} ==")
+    print(f"延迟: 平均 {sum(latencies) / len(latencies):.2f}s  p50 {percentile(latencies, 0.5):.2f}s  p95 {percentile(latencies, 0.95):.2f}s  总计 {sum(latencies):.1f}s")
+    print(f"准确率: {total_correct}/{len(corpus)}  简单 {correct['simple'][0]}/{correct['simple'][1]}  复杂 {correct['complex'][0]}/{correct['complex'][1]}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default=CORPUS_PATH)
+    parser.add_argument("--base-url", default=os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434"))
+    parser.add_argument("--large-model", default="qwen2.5-coder:latest")
+    parser.add_argument("--small-model", default=os.environ.get("SMALL_LLM_MODEL", "qwen2.5-coder:1.5b"))
+    parser.add_argument("--modes", nargs="+", default=["large", "routed"], choices=["large", "routed"])
+    parser.add_argument("--java-api", help="Java API地址，指定时按执行结果判断准确率")
+    parser.add_argument("--classify-only", action="store_true", help="只输出分类结果，不调用模型")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    large = LLMClient(provider=LLMProvider.OLLAMA, base_url=args.base_url, model=args.large_model)
+    small = LLMClient(provider=LLMProvider.OLLAMA, base_url=args.base_url, model=args.small_model)
+    generator = SQLGenerator(llm_client=large, small_llm_client=small)
+    # 不使用QA知识库，所有查询都经过模型
+    generator.qa_match_threshold = float("inf")
+
+    if args.classify_only:
+        classify_only(generator, corpus)
+        return
+
+    java_client = None
+    expected_results = {}
+    if args.java_api:
+        from java_api_client import JavaAPIClient
+        java_client = JavaAPIClient(args.java_api)
+        expected_results = {item["query"]: result_key(java_client.execute_sql(item["sql"], use_cache=False)) for item in corpus}
+
+    generator.preload_models()
+    for mode in args.modes:
+        run_mode(generator, corpus, mode, java_client, expected_results)
+    print("\n" + json.dumps(generator.router.get_metrics(), ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
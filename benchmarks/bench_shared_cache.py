@@ -0,0 +1,81 @@
+"""
+共享缓存基准测试：比较进程内缓存（每个worker各一份）与SQLite共享缓存在多worker下的命中率和查询延迟
+
+用法：
+    python benchmarks/bench_shared_cache.py --workers 1 4 16
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from result_cache import TTLCache
+from shared_cache import SQLiteCache
+
+def run_worker(args):
+    backend, path, worker_id, requests, cum_weights, value_size = args
+    rng = random.Random(worker_id)
+    if backend == "sqlite":
+        cache = SQLiteCache(path, max_bytes=512 * 1024 * 1024)
+    else:
+        cache = TTLCache(max_entries=100000, ttl=3600)
+
+    value = {"sql": "SELECT ts_code, stock_name FROM stock_business", "data": "x" * value_size}
+    keys = range(len(cum_weights))
+    hits = 0
+    latencies = []
+    for _ in range(requests):
+        key = f"key-{rng.choices(keys, cum_weights=cum_weights)[0]}"
+        start = time.perf_counter()
+        cached = cache.get(key)
+        latencies.append(time.perf_counter() - start)
+        if cached is not None:
+            hits += 1
+        else:
+            cache.set(key, value)
+    return hits, latencies
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def main():
+    parser = argparse.ArgumentParser(description="共享缓存基准测试")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=16000, help="总请求数，平均分配给各worker，模拟负载均衡")
+    parser.add_argument("--keys", type=int, default=2000, help="不同查询的数量")
+    parser.add_argument("--zipf", type=float, default=1.1, help="查询热度的Zipf分布参数")
+    parser.add_argument("--value-size", type=int, default=2000, help="缓存值大小（字节）")
+    args = parser.parse_args()
+
+    weights = [1 / (rank ** args.zipf) for rank in range(1, args.keys + 1)]
+    cum_weights = []
+    total = 0
+    for weight in weights:
+        total += weight
+        cum_weights.append(total)
+
+    print(f"{'backend':<8} {'workers':>7} {'hit_rate':>9} {'get_p50_us':>11} {'get_p99_us':>11} {'elapsed_s':>10}")
+    for workers in args.workers:
+        for backend in ("memory", "sqlite"):
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = os.path.join(tmpdir, "cache.sqlite3")
+                if backend == "sqlite":
+                    SQLiteCache(path)
+                tasks = [(backend, path, i, args.requests // workers, cum_weights, args.value_size) for i in range(workers)]
+                start = time.time()
+                with multiprocessing.Pool(workers) as pool:
+                    results = pool.map(run_worker, tasks)
+                elapsed = time.time() - start
+
+            hits = sum(result[0] for result in results)
+            latencies = sorted(latency for result in results for latency in result[1])
+            print(f"{backend:<8} {workers:>7} {hits / len(latencies):>9.3f} "
+                  f"{percentile(latencies, 0.5) * 1e6:>11.1f} {percentile(latencies, 0.99) * 1e6:>11.1f} {elapsed:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -20,7 +20,28 @@ sleep 10
 # 下载必要的模型
 echo "下载 Ollama 模型..."
 docker-compose exec ollama ollama pull qwen2.5-coder:latest
+# 简单查询使用的小模型（模型路由）
+docker-compose exec ollama ollama pull qwen2.5-coder:1.5b
 docker-compose exec ollama ollama pull bge-large:latest
 
+# 模型就绪后重启应用，让启动预热能预加载模型
+docker-compose restart text2sql
+
+# 等待预热完成，/ready 返回200后才对外提供服务
+echo "等待服务预热..."
+ready=0
+for i in $(seq 1 60); do
+    if curl -sf http://localhost:5000/ready > /dev/null; then
+        echo "服务预热完成"
+        ready=1
+        break
+    fi
+    sleep 5
+done
+if [ "$ready" -ne 1 ]; then
+    echo "服务预热超时，/ready 仍未返回200，请检查 docker-compose logs text2sql" >&2
+    exit 1
+fi
+
 echo "部署完成！"
 echo "服务访问地址: http://localhost:5000" 
\ No newline at end of file
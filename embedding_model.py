@@ -1,18 +1,22 @@
+import os
 import requests
 import json
+from shared_cache import get_cache, make_cache_key
 
 class EmbeddingModel:
-    def __init__(self, base_url="http://localhost:11434", model="bge-large:latest"):
+    def __init__(self, base_url=None, model="bge-large:latest", cache=None):
         """
         初始化向量嵌入模型
         
         Args:
-            base_url (str): Ollama服务的基础URL
+            base_url (str, optional): Ollama服务的基础URL，默认读取OLLAMA_BASE_URL
             model (str): 嵌入模型名称
+            cache (optional): 向量缓存，默认按CACHE_BACKEND环境变量创建
         """
-        self.base_url = base_url
+        self.base_url = base_url or os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
         self.model = model
-        self.api_url = f"{base_url}/api/embeddings"
+        self.api_url = f"{self.base_url}/api/embeddings"
+        self.cache = cache if cache is not None else get_cache("embedding", ttl=float(os.environ.get("EMBEDDING_CACHE_TTL", "604800")))
     
     def get_embedding(self, text):
         """
@@ -24,6 +28,12 @@ class EmbeddingModel:
         Returns:
             list: 向量嵌入结果
         """
+        cache_key = make_cache_key(self.model, text) if self.cache is not None else None
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
         data = {
             "model": self.model,
             "prompt": text
@@ -33,7 +43,10 @@ class EmbeddingModel:
             response = requests.post(self.api_url, json=data)
             response.raise_for_status()
             result = response.json()
-            return result.get("embedding", [])
+            embedding = result.get("embedding", [])
+            if cache_key and embedding:
+                self.cache.set(cache_key, embedding)
+            return embedding
         except Exception as e:
             print(f"获取嵌入向量时出错: {e}")
             return []
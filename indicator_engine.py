@@ -0,0 +1,413 @@
+import os
+import re
+import time
+import threading
+from collections import namedtuple
+from result_cache import TTLCache, get_data_version
+from schema_registry import DEFAULT_TABLE, get_schema_registry
+from java_api_client import JavaAPIError
+
+# 可选依赖：跨交易日条件的向量化计算
+try:
+    import numpy as np
+    use_numpy = True
+except ImportError:
+    use_numpy = False
+
+class InvalidExpression(ValueError):
+    """表达式格式错误、字段不可用或需要的交易日数超过上限"""
+
+# 可作为数值序列参与计算的字段类型
+_NUMERIC_TYPE_PATTERN = re.compile(r'^(decimal|numeric|float|double|real|int|integer|bigint|smallint|tinyint|mediumint)\b', re.IGNORECASE)
+_IDENTIFIER_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# 基本运算：params中的n为窗口长度（交易日数），lookback为计算最新一天结果需要额外回看的天数
+Primitive = namedtuple('Primitive', ['func', 'params', 'lookback', 'description'])
+
+def _shift(x, n):
+    if np.ndim(x) == 0:
+        return x
+    n = int(n)
+    out = np.full(x.shape, np.nan)
+    if n < x.shape[1]:
+        out[:, n:] = x[:, :x.shape[1] - n]
+    return out
+
+def _rolling(x, n, reducer):
+    n = int(n)
+    x = np.asarray(x, dtype=float)
+    out = np.full(x.shape, np.nan)
+    if n <= x.shape[1]:
+        windows = np.lib.stride_tricks.sliding_window_view(x, n, axis=1)
+        out[:, n - 1:] = reducer(windows, axis=-1)
+    return out
+
+def _streak(cond, n):
+    # 窗口内有缺失数据（停牌等）时不算连续
+    return _rolling(cond, n, np.min) == 1
+
+def _within(cond, n):
+    return _rolling(cond, n, np.max) == 1
+
+def _cross_above(a, b):
+    return (a > b) & (_shift(a, 1) <= _shift(b, 1))
+
+def _cross_below(a, b):
+    return (a < b) & (_shift(a, 1) >= _shift(b, 1))
+
+def _pct_change(x, n):
+    previous = _shift(x, n)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (x - previous) / np.abs(previous) * 100
+
+PRIMITIVES = {
+    'shift': Primitive(_shift, ('x', 'n'), lambda n: n, 'n个交易日前的值'),
+    'pct_change': Primitive(_pct_change, ('x', 'n'), lambda n: n, '相对n个交易日前的涨跌幅（%）'),
+    'rolling_mean': Primitive(lambda x, n: _rolling(x, n, np.mean), ('x', 'n'), lambda n: n - 1, '最近n个交易日的均值'),
+    'rolling_max': Primitive(lambda x, n: _rolling(x, n, np.max), ('x', 'n'), lambda n: n - 1, '最近n个交易日的最大值'),
+    'rolling_min': Primitive(lambda x, n: _rolling(x, n, np.min), ('x', 'n'), lambda n: n - 1, '最近n个交易日的最小值'),
+    'streak': Primitive(_streak, ('cond', 'n'), lambda n: n - 1, '最近n个交易日条件均成立（连续n天）'),
+    'within': Primitive(_within, ('cond', 'n'), lambda n: n - 1, '最近n个交易日内条件至少成立一次（n日内）'),
+    'cross_above': Primitive(_cross_above, ('a', 'b'), lambda: 1, '上穿：当日a>b且前一日a<=b（金叉、站上）'),
+    'cross_below': Primitive(_cross_below, ('a', 'b'), lambda: 1, '下穿：当日a<b且前一日a>=b（死叉、跌破）'),
+    'gt': Primitive(lambda a, b: a > b, ('a', 'b'), lambda: 0, 'a > b'),
+    'ge': Primitive(lambda a, b: a >= b, ('a', 'b'), lambda: 0, 'a >= b'),
+    'lt': Primitive(lambda a, b: a < b, ('a', 'b'), lambda: 0, 'a < b'),
+    'le': Primitive(lambda a, b: a <= b, ('a', 'b'), lambda: 0, 'a <= b'),
+    'eq': Primitive(lambda a, b: a == b, ('a', 'b'), lambda: 0, 'a = b'),
+    'and': Primitive(lambda *conds: np.logical_and.reduce(conds), ('cond', '...'), lambda: 0, '所有条件均成立'),
+    'or': Primitive(lambda *conds: np.logical_or.reduce(conds), ('cond', '...'), lambda: 0, '任一条件成立'),
+    'not': Primitive(lambda cond: ~np.asarray(cond, dtype=bool), ('cond',), lambda: 0, '条件不成立')
+}
+
+# 结果为条件（布尔值）的基本运算，表达式的最外层和cond参数只能使用这些运算
+CONDITION_PRIMITIVES = {'gt', 'ge', 'lt', 'le', 'eq', 'cross_above', 'cross_below', 'streak', 'within', 'and', 'or', 'not'}
+
+# 比较运算符 -> 基本运算
+COMPARISON_PRIMITIVES = {'>': 'gt', '>=': 'ge', '<': 'lt', '<=': 'le', '=': 'eq'}
+
+def describe_primitives():
+    """
+    列出支持的基本运算，供自然语言层或调用方构造表达式
+
+    表达式为嵌套列表：["运算名", 参数...]，参数可以是字段名、数值或子表达式，
+    如["within", ["cross_above", "factor_macd_dif", "factor_macd_dea"], 5]表示5日内MACD金叉。
+    """
+    return [
+        {'name': name, 'params': list(primitive.params), 'description': primitive.description}
+        for name, primitive in PRIMITIVES.items()
+    ]
+
+def expression_lookback(expression):
+    """计算表达式在最新一天求值需要回看的交易日数"""
+    if not isinstance(expression, list):
+        return 0
+    primitive = PRIMITIVES[expression[0]]
+    args = expression[1:]
+    if 'n' in primitive.params:
+        n = int(args[primitive.params.index('n')])
+        return primitive.lookback(n) + max(expression_lookback(arg) for arg in args)
+    return primitive.lookback() + max((expression_lookback(arg) for arg in args), default=0)
+
+def expression_fields(expression, fields=None):
+    """收集表达式引用的字段，保持出现顺序"""
+    fields = [] if fields is None else fields
+    if isinstance(expression, str):
+        if expression not in fields:
+            fields.append(expression)
+    elif isinstance(expression, list):
+        for arg in expression[1:]:
+            expression_fields(arg, fields)
+    return fields
+
+# 跨交易日条件的自然语言模式
+_STREAK_PATTERN = re.compile(r'连续(?P<n>\d+)(?:个交易日|个|天|日)(?P<event>放量|缩量|上涨|下跌)')
+_CROSS_PATTERN = re.compile(
+    r'(?:(?:近|最近)?(?P<n>\d+)(?:个交易日|天|日)内(?:出现)?)?(?P<indicator>MACD|KDJ)(?:指标)?(?P<event>金叉|死叉)',
+    re.IGNORECASE
+)
+_MA_PATTERN = re.compile(
+    r'(?:股价|收盘价)?(?P<event>站上|突破|跌破)(?P<n>\d+)日均线(?P<previous>[，,]?(?:且|并且)?前一(?:日|天|个交易日)(?:在|位于)?(?:均线)?(?P<side>下方|之下|上方|之上))?'
+)
+# 表中已有的均线字段
+_MA_FIELDS = {5: 'ma5', 10: 'ma10', 20: 'ma20', 30: 'ma30', 60: 'ma60', 120: 'ma120'}
+_CROSS_FIELDS = {
+    'macd': ('factor_macd_dif', 'factor_macd_dea'),
+    'kdj': ('factor_kdj_k', 'factor_kdj_d')
+}
+
+def _streak_expression(match):
+    n = int(match.group('n'))
+    event = match.group('event')
+    if event in ('放量', '缩量'):
+        condition = ['gt' if event == '放量' else 'lt', 'factor_vol', ['shift', 'factor_vol', 1]]
+    else:
+        condition = ['gt' if event == '上涨' else 'lt', 'factor_pct_change', 0]
+    return ['streak', condition, n]
+
+def _cross_expression(match):
+    fast, slow = _CROSS_FIELDS[match.group('indicator').lower()]
+    cross = ['cross_above' if match.group('event') == '金叉' else 'cross_below', fast, slow]
+    return ['within', cross, int(match.group('n'))] if match.group('n') else cross
+
+def _ma_expression(match):
+    n = int(match.group('n'))
+    average = _MA_FIELDS.get(n) or ['rolling_mean', 'daily_close', n]
+    above = match.group('event') != '跌破'
+    side = match.group('side')
+    if side is None:
+        if match.group('event') == '站上':
+            # 只说"站上"时不要求前一日在下方
+            return ['gt', 'daily_close', average]
+        return ['cross_above' if above else 'cross_below', 'daily_close', average]
+    # 前一日在均线另一侧才是上穿/下穿；前一日在同一侧时两天都需要满足
+    if (side in ('下方', '之下')) == above:
+        return ['cross_above' if above else 'cross_below', 'daily_close', average]
+    operator = 'gt' if above else 'lt'
+    return ['and', [operator, 'daily_close', average], [operator, ['shift', 'daily_close', 1], ['shift', average, 1]]]
+
+_PATTERNS = [
+    (_STREAK_PATTERN, _streak_expression),
+    (_CROSS_PATTERN, _cross_expression),
+    (_MA_PATTERN, _ma_expression)
+]
+
+def parse_indicator_query(user_query):
+    """
+    从自然语言查询中识别跨交易日条件
+
+    支持连续N天放量/缩量/上涨/下跌、N日内MACD/KDJ金叉/死叉、站上/突破/跌破N日均线（且前一日在下方）。
+
+    Args:
+        user_query (str): 用户的自然语言查询
+
+    Returns:
+        tuple: (表达式列表, 去掉已识别条件后剩余的文本)，没有跨交易日条件时表达式列表为空
+    """
+    expressions = []
+    remainder = user_query
+    for pattern, build in _PATTERNS:
+        for match in pattern.finditer(remainder):
+            expressions.append(build(match))
+        remainder = pattern.sub(' ', remainder)
+    return expressions, remainder
+
+class IndicatorPanel:
+    """多个交易日的数据按股票 × 交易日展开的二维数组"""
+
+    def __init__(self, codes, names, dates, fields):
+        self.codes = codes
+        self.names = names
+        self.dates = dates
+        self.fields = fields
+
+    @classmethod
+    def from_rows(cls, rows, fields):
+        """将按行返回的结果转换为每个字段一个二维数组，缺失值为NaN"""
+        codes, dates, names = [], [], {}
+        columns = {field: [] for field in fields}
+        for row in rows:
+            codes.append(row['ts_code'])
+            dates.append(str(row['trade_date']))
+            names[row['ts_code']] = row.get('stock_name')
+            for field in fields:
+                columns[field].append(row.get(field))
+
+        unique_codes, code_index = np.unique(np.array(codes, dtype=str), return_inverse=True)
+        unique_dates, date_index = np.unique(np.array(dates, dtype=str), return_inverse=True)
+        shape = (len(unique_codes), len(unique_dates))
+        arrays = {}
+        for field in fields:
+            array = np.full(shape, np.nan)
+            array[code_index, date_index] = np.array(columns[field], dtype=float)
+            arrays[field] = array
+        return cls(
+            unique_codes.tolist(),
+            [names.get(code) for code in unique_codes.tolist()],
+            unique_dates.tolist(),
+            arrays
+        )
+
+    def evaluate(self, expression):
+        """对表达式求值，返回股票 × 交易日的数组"""
+        if isinstance(expression, str):
+            return self.fields[expression]
+        if isinstance(expression, (int, float)):
+            return expression
+        args = [
+            arg if param == 'n' else self.evaluate(arg)
+            for param, arg in zip(PRIMITIVES[expression[0]].params + ('...',) * len(expression), expression[1:])
+        ]
+        return PRIMITIVES[expression[0]].func(*args)
+
+class IndicatorEngine:
+    def __init__(self, java_api_client, table=None, max_days=None):
+        """
+        初始化跨交易日指标引擎
+
+        一次取回所需字段在日期窗口内的数据，展开为股票 × 交易日的数组后向量化计算交叉、连续、滚动比较等条件，
+        不需要LLM生成自连接或窗口函数。
+
+        Args:
+            java_api_client (JavaAPIClient): Java API客户端
+            table (TableSchema, optional): 数据表结构，默认为stock_business
+            max_days (int, optional): 最多取回的交易日数，默认读取INDICATOR_MAX_DAYS
+        """
+        self.java_api_client = java_api_client
+        self.table = table or get_schema_registry().get_table(DEFAULT_TABLE)
+        self.max_days = max_days or int(os.environ.get("INDICATOR_MAX_DAYS", "250"))
+        # (数据版本, 交易日数, 字段) -> IndicatorPanel，同一交易日内相同的窗口只取一次
+        self._numeric_fields = None
+        self._panels = TTLCache(
+            max_entries=int(os.environ.get("INDICATOR_PANEL_CACHE_SIZE", "8")),
+            ttl=float(os.environ.get("RESULT_CACHE_TTL", "28800"))
+        )
+        # 每个缓存键一把锁，同一窗口并发请求时只取一次数据，不同窗口可以同时取数
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def numeric_fields(self):
+        """可以参与计算的数值字段"""
+        if self._numeric_fields is None:
+            self._numeric_fields = [name for name, info in self.table.columns.items() if _NUMERIC_TYPE_PATTERN.match(info['type'])]
+        return self._numeric_fields
+
+    def normalize(self, expression, condition=True):
+        """
+        校验表达式并将字段别名解析为字段名
+
+        Args:
+            expression: 表达式，格式见describe_primitives()
+            condition (bool): 是否要求表达式的结果为条件，最外层和cond参数为True
+
+        Raises:
+            InvalidExpression: 表达式格式错误、运算不存在或字段不可用
+        """
+        if isinstance(expression, bool):
+            raise InvalidExpression("表达式中不能使用布尔值")
+        if condition and not (isinstance(expression, list) and expression and expression[0] in CONDITION_PRIMITIVES):
+            # 字段或数值运算的结果转换为布尔值后，所有非零的股票都会被选中
+            raise InvalidExpression(f"需要条件表达式（{', '.join(sorted(CONDITION_PRIMITIVES))}）: {expression}")
+        if isinstance(expression, (int, float)):
+            return expression
+        if isinstance(expression, str):
+            field = self.table.resolve(expression)
+            if not field or not _IDENTIFIER_PATTERN.match(field) or field not in self.numeric_fields():
+                raise InvalidExpression(f"不支持的字段: {expression}")
+            return field
+        if not isinstance(expression, list) or not expression or expression[0] not in PRIMITIVES:
+            raise InvalidExpression(f"不支持的表达式: {expression}")
+
+        name, args = expression[0], expression[1:]
+        params = PRIMITIVES[name].params
+        if params[-1] == '...':
+            if not args:
+                raise InvalidExpression(f"{name}至少需要一个参数")
+        elif len(args) != len(params):
+            raise InvalidExpression(f"{name}需要{len(params)}个参数: {', '.join(params)}")
+
+        normalized = [name]
+        # 可变参数与前一个参数类型相同，如and/or的每个参数都是条件
+        params = params[:-1] + (params[-2],) if params[-1] == '...' else params
+        for param, arg in zip(params + (params[-1],) * len(args), args):
+            if param == 'n':
+                if isinstance(arg, bool) or not isinstance(arg, int) or not 1 <= arg <= self.max_days:
+                    raise InvalidExpression(f"{name}的窗口长度需要是1到{self.max_days}之间的整数")
+                normalized.append(arg)
+            else:
+                normalized.append(self.normalize(arg, condition=param == 'cond'))
+        return normalized
+
+    def _trade_dates(self, days):
+        """最近的若干个交易日，从早到晚排列"""
+        sql = f"SELECT DISTINCT trade_date FROM {self.table.name} ORDER BY trade_date DESC LIMIT {days}"
+        result = self.java_api_client.execute_sql(sql)
+        if result.get("code") != 0:
+            raise JavaAPIError(result.get("msg", "获取交易日失败"))
+        return sorted(str(row["trade_date"]) for row in result.get("data") or [])
+
+    def panel_sql(self, fields, days):
+        """取回窗口内数据的SQL，返回(SQL, 交易日列表)"""
+        dates = self._trade_dates(days)
+        if not dates:
+            return None, dates
+        columns = ", ".join(["ts_code", "stock_name", "trade_date"] + fields)
+        sql = f"SELECT {columns} FROM {self.table.name} WHERE trade_date >= '{dates[0]}' AND trade_date <= '{dates[-1]}'"
+        return sql, dates
+
+    def load_panel(self, fields, days):
+        """
+        取回最近days个交易日的数据并展开为IndicatorPanel
+
+        Returns:
+            tuple: (取数SQL, IndicatorPanel)
+        """
+        cache_key = (get_data_version(), days, tuple(fields))
+        cached = self._panels.get(cache_key)
+        if cached is not None:
+            return cached
+
+        # 同一窗口并发请求时只取一次数据
+        with self._lock:
+            key_lock = self._loading.setdefault(cache_key, threading.Lock())
+        try:
+            with key_lock:
+                cached = self._panels.get(cache_key)
+                if cached is not None:
+                    return cached
+                start = time.time()
+                sql, dates = self.panel_sql(fields, days)
+                if sql is None:
+                    panel = IndicatorPanel([], [], [], {field: np.empty((0, 0)) for field in fields})
+                else:
+                    panel = IndicatorPanel.from_rows(self.java_api_client.stream_sql(sql), fields)
+                print(f"已加载{len(panel.codes)}只股票 × {len(panel.dates)}个交易日的数据，耗时 {time.time() - start:.2f}s")
+                self._panels.set(cache_key, (sql, panel))
+                return sql, panel
+        finally:
+            with self._lock:
+                if self._loading.get(cache_key) is key_lock:
+                    del self._loading[cache_key]
+
+    def screen(self, expression):
+        """
+        按跨交易日条件筛选股票，条件在最新交易日成立的股票返回其最新一天的字段值
+
+        Args:
+            expression (list): 条件表达式，格式见describe_primitives()
+
+        Returns:
+            tuple: (取数SQL, 与Java API格式一致的结果)
+
+        Raises:
+            InvalidExpression: 表达式无效或窗口超过INDICATOR_MAX_DAYS
+        """
+        expression = self.normalize(expression)
+        days = expression_lookback(expression) + 1
+        if days > self.max_days:
+            raise InvalidExpression(f"条件需要{days}个交易日的数据，超过上限{self.max_days}")
+        fields = expression_fields(expression)
+
+        try:
+            sql, panel = self.load_panel(fields, days)
+        except JavaAPIError as e:
+            return None, {"msg": str(e), "code": -1, "data": []}
+        if not panel.codes or len(panel.dates) < days:
+            return sql, {"msg": "交易日数据不足", "code": 0, "data": []}
+
+        start = time.time()
+        matched = np.asarray(panel.evaluate(expression), dtype=bool)
+        if matched.ndim != 2:
+            raise InvalidExpression("表达式的结果需要是条件而不是常数")
+        matched = np.flatnonzero(matched[:, -1])
+
+        latest = panel.dates[-1]
+        data = []
+        for index in matched.tolist():
+            row = {"ts_code": panel.codes[index], "stock_name": panel.names[index], "trade_date": latest}
+            for field in fields:
+                value = panel.fields[field][index, -1]
+                row[field] = None if np.isnan(value) else float(value)
+            data.append(row)
+        print(f"指标筛选 {expression} 命中{len(data)}只股票，计算耗时 {(time.time() - start) * 1000:.1f}ms")
+        return sql, {"msg": "success", "code": 0, "data": data}
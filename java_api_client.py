@@ -1,26 +1,52 @@
+import os
 import requests
 import json
+from result_cache import get_data_version
+from shared_cache import get_cache, make_cache_key
+from sql_canonical import canonicalize_sql
+from json_stream import JSONArrayStream
+
+class JavaAPIError(Exception):
+    """Java API返回执行失败"""
 
 class JavaAPIClient:
-    def __init__(self, api_url="http://localhost:8082/system/llm/execute"):
+    def __init__(self, api_url="http://localhost:8082/system/llm/execute", cache=None):
         """
         初始化Java API客户端
         
         Args:
             api_url (str): Java API的URL
+            cache (optional): 查询结果缓存，默认按CACHE_BACKEND环境变量创建
         """
         self.api_url = api_url
+        self.cache = cache if cache is not None else get_cache("result", ttl=float(os.environ.get("RESULT_CACHE_TTL", "28800")))
     
-    def execute_sql(self, sql):
+    def execute_sql(self, sql, use_cache=True):
         """
         执行SQL查询
         
+        执行成功的结果按（数据版本, 规范化SQL）缓存。
+        
         Args:
             sql (str): 要执行的SQL语句
+            use_cache (bool): 是否读取缓存，为False时总是执行并刷新缓存
             
         Returns:
             dict: API返回的JSON结果
         """
+        cache_key = make_cache_key(get_data_version(), canonicalize_sql(sql)) if self.cache is not None else None
+        if cache_key and use_cache:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        result = self._execute_sql(sql)
+        if cache_key and result.get("code") == 0:
+            self.cache.set(cache_key, result)
+        return result
+    
+    def _execute_sql(self, sql):
+        """调用Java API执行SQL"""
         headers = {
             "accept": "*/*",
             "Content-Type": "application/json; charset=utf-8"
@@ -59,4 +85,44 @@ class JavaAPIClient:
                 "msg": f"SQL执行失败: {error_msg}",
                 "code": -1,
                 "data": []
-            } 
\ No newline at end of file
+            }
+    
+    def stream_sql(self, sql, chunk_size=65536):
+        """
+        流式执行SQL，边接收边解析，逐行返回结果，不缓存
+        
+        Args:
+            sql (str): 要执行的SQL语句
+            chunk_size (int): 每次读取的字节数
+            
+        Yields:
+            dict: 每行结果
+            
+        Raises:
+            JavaAPIError: Java API返回执行失败、无法连接、HTTP错误或响应格式错误
+        """
+        headers = {
+            "accept": "*/*",
+            "Content-Type": "application/json; charset=utf-8"
+        }
+        sql = sql.strip()
+        print(f"流式发送SQL: {sql}")
+        
+        try:
+            response = requests.post(self.api_url, data=sql.encode('utf-8'), headers=headers, stream=True)
+        except requests.RequestException as e:
+            raise JavaAPIError(f"Java API请求失败: {e}") from e
+        try:
+            response.raise_for_status()
+            stream = JSONArrayStream(response.iter_content(chunk_size), key="data")
+            for row in stream:
+                # 执行失败时code通常在data之前
+                if stream.meta.get("code", 0) != 0:
+                    break
+                yield row
+            if stream.meta.get("code", 0) != 0:
+                raise JavaAPIError(f"SQL执行失败: {stream.meta.get('msg', '')}")
+        except (requests.RequestException, ValueError) as e:
+            raise JavaAPIError(f"Java API请求失败: {e}") from e
+        finally:
+            response.close()
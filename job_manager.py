@@ -0,0 +1,233 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from admission_control import AdmissionRejected
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+class Job:
+    """一个后台查询任务，记录状态、各阶段耗时和结果"""
+
+    def __init__(self, key, query, on_change=None):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.query = query
+        self.status = JOB_QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.timings = {}
+        # 当前阶段，提交后先处于排队阶段
+        self.stage_name = "queued"
+        self.stage_started_at = self.created_at
+        self.payload = None
+        self.error = None
+        self.attached = 0
+        # 状态变化时的回调，用于把任务状态同步到共享缓存
+        self.on_change = on_change
+
+    def stage(self, name):
+        """进入新的阶段，上一阶段的耗时计入timings"""
+        now = time.time()
+        if self.stage_name is not None:
+            self.timings[self.stage_name] = round(self.timings.get(self.stage_name, 0) + now - self.stage_started_at, 3)
+        self.stage_name = name
+        self.stage_started_at = now if name is not None else None
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def snapshot(self):
+        """任务状态，进行中的阶段显示已用时间"""
+        now = time.time()
+        timings = dict(self.timings)
+        if self.stage_name is not None:
+            timings[self.stage_name] = round(timings.get(self.stage_name, 0) + now - self.stage_started_at, 3)
+        snapshot = {
+            "job_id": self.id,
+            "status": self.status,
+            "query": self.query,
+            "created_at": self.created_at,
+            "stage": self.stage_name,
+            "timings": timings,
+            "elapsed": round((self.finished_at or now) - self.created_at, 3),
+            "attached": self.attached
+        }
+        if self.error is not None:
+            snapshot["error"] = self.error
+        if self.payload is not None:
+            snapshot.update(self.payload)
+        return snapshot
+
+class JobManager:
+    def __init__(self, max_workers=None, max_pending=None, retention=None, admission_retries=None, result_cache=None):
+        """
+        初始化后台任务管理器，耗时较长的查询在有界线程池中执行，请求立即返回任务编号
+
+        Args:
+            max_workers (int, optional): 同时执行的任务数，默认读取JOB_MAX_WORKERS
+            max_pending (int, optional): 未完成任务数上限，超过时拒绝提交，默认读取JOB_MAX_PENDING
+            retention (float, optional): 已完成任务的保留时间（秒），默认读取JOB_RESULT_TTL
+            admission_retries (int, optional): LLM准入控制拒绝时的重试次数，默认读取JOB_ADMISSION_RETRIES
+            result_cache (optional): 多个worker共用的缓存，保存任务状态和去重键对应的任务编号，
+                任意worker都能查询进行中和已完成的任务，相同查询只执行一次
+        """
+        self.max_workers = max_workers or int(os.environ.get("JOB_MAX_WORKERS", "4"))
+        self.max_pending = max_pending or int(os.environ.get("JOB_MAX_PENDING", "100"))
+        self.retention = retention or float(os.environ.get("JOB_RESULT_TTL", "3600"))
+        self.admission_retries = admission_retries if admission_retries is not None else int(os.environ.get("JOB_ADMISSION_RETRIES", "3"))
+        self.result_cache = result_cache
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        # 去重键 -> 未完成的任务
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, query, func):
+        """
+        提交任务，相同去重键的任务未完成时（包括其他worker上的任务）直接返回该任务
+
+        Args:
+            key (str): 去重键，如（数据版本, 查询）的哈希
+            query (str): 用户查询，用于展示
+            func (callable): 任务函数，参数为Job，各阶段开始时调用job.stage(阶段名)，返回响应内容
+
+        Returns:
+            tuple: (任务状态, 是否为已有任务)
+
+        Raises:
+            AdmissionRejected: 未完成的任务数已达上限
+        """
+        with self._lock:
+            self._purge()
+            existing = self._active.get(key)
+            if existing is not None:
+                existing.attached += 1
+                return existing.snapshot(), True
+            if len(self._active) >= self.max_pending:
+                raise AdmissionRejected(f"后台任务已满（{self.max_pending}个）", retry_after=10)
+            job = Job(key, query, on_change=self._publish)
+            # 其他worker上相同查询的任务未完成时直接返回该任务
+            remote = self._claim(key, job.id)
+            if remote is not None:
+                return remote, True
+            self._jobs[job.id] = job
+            self._active[key] = job
+
+        self._publish(job)
+        self._executor.submit(self._run, job, func)
+        return job.snapshot(), False
+
+    def _claim(self, key, job_id):
+        """
+        在共享缓存中登记去重键对应的任务编号
+
+        Returns:
+            dict: 其他worker上未完成的相同任务的状态，登记成功时返回None
+        """
+        if self.result_cache is None:
+            return None
+        active_key = f"active:{key}"
+        try:
+            # 登记的任务已完成或状态已过期（如所在进程退出）时删除登记后重试一次
+            for _ in range(2):
+                if self.result_cache.add(active_key, job_id, ttl=self.retention):
+                    return None
+                owner = self.result_cache.get(active_key)
+                snapshot = self.result_cache.get(owner) if owner else None
+                if snapshot is not None and snapshot["status"] in (JOB_QUEUED, JOB_RUNNING):
+                    return snapshot
+                self.result_cache.delete(active_key)
+        except Exception as e:
+            print(f"登记后台任务时出错: {e}")
+        return None
+
+    def _publish(self, job):
+        """把任务状态写入共享缓存，其他worker也能查询进行中的任务"""
+        if self.result_cache is None:
+            return
+        try:
+            self.result_cache.set(job.id, job.snapshot(), ttl=self.retention)
+        except Exception as e:
+            print(f"保存后台任务状态时出错: {e}")
+
+    def _run(self, job, func):
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        self._publish(job)
+        attempts = 0
+        while True:
+            try:
+                job.payload = func(job)
+                job.status = JOB_SUCCEEDED
+                break
+            except AdmissionRejected as e:
+                # LLM排队过长时稍后重试，后台任务不需要立即返回
+                attempts += 1
+                if attempts > self.admission_retries:
+                    job.error = f"服务繁忙: {str(e)}"
+                    job.status = JOB_FAILED
+                    break
+                job.stage("waiting_for_llm")
+                time.sleep(e.retry_after)
+            except Exception as e:
+                print(f"后台任务 {job.id} 出错: {e}")
+                job.error = str(e)
+                job.status = JOB_FAILED
+                break
+        job.stage(None)
+        job.finished_at = time.time()
+
+        with self._lock:
+            if self._active.get(job.key) is job:
+                del self._active[job.key]
+        # job.stage(None)已写入最终状态，这里补上结束时间后再写一次，然后释放去重登记
+        self._publish(job)
+        if self.result_cache is not None:
+            try:
+                if self.result_cache.get(f"active:{job.key}") == job.id:
+                    self.result_cache.delete(f"active:{job.key}")
+            except Exception as e:
+                print(f"释放后台任务登记时出错: {e}")
+        print(f"后台任务 {job.id} {job.status}，耗时 {job.finished_at - job.created_at:.2f}s: {job.query}")
+
+    def _purge(self):
+        """删除超过保留时间的已完成任务"""
+        cutoff = time.time() - self.retention
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """
+        获取任务状态
+
+        Returns:
+            dict: 任务状态，任务不存在或已过期时返回None
+        """
+        with self._lock:
+            self._purge()
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job.snapshot()
+        # 其他worker上的任务，状态在提交、每个阶段开始和完成时写入共享缓存
+        if self.result_cache is not None:
+            return self.result_cache.get(job_id)
+        return None
+
+    def get_metrics(self):
+        """任务数量统计"""
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "jobs": counts
+        }
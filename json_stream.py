@@ -0,0 +1,96 @@
+import re
+import json
+import codecs
+
+_WHITESPACE = re.compile(r'\s*')
+
+class JSONArrayStream:
+    def __init__(self, chunks, key="data"):
+        """
+        增量解析形如{"msg": ..., "code": ..., "data": [...]}的JSON响应，逐个返回数组中的元素
+
+        已解析的内容会从缓冲区中丢弃，内存占用只与单个元素和分块大小有关，与数组长度无关。
+        数组以外的顶层字段保存在meta中。
+
+        Args:
+            chunks (iterable): 字节或字符串分块，如requests的response.iter_content()
+            key (str): 需要流式解析的数组字段名
+        """
+        self.key = key
+        self.meta = {}
+        self._chunks = iter(chunks)
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json_decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """读取下一个分块，返回False表示已到结尾"""
+        while not self._eof:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._eof = True
+                text = self._text_decoder.decode(b"", final=True)
+            elif isinstance(chunk, bytes):
+                text = self._text_decoder.decode(chunk)
+            else:
+                text = chunk
+            if text:
+                self._buffer = self._buffer[self._pos:] + text
+                self._pos = 0
+                return True
+        return False
+
+    def _peek(self):
+        """跳过空白，返回下一个字符"""
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("JSON响应意外结束")
+
+    def _expect(self, chars):
+        char = self._peek()
+        if char not in chars:
+            raise ValueError(f"JSON响应格式错误，期望{chars}，实际为{char!r}")
+        self._pos += 1
+        return char
+
+    def _decode_value(self):
+        """解析一个完整的JSON值，缓冲区中的内容不完整时继续读取"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # 数字等值可能在分块边界被截断，到达缓冲区末尾时再读取一块确认
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def __iter__(self):
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            name = self._decode_value()
+            self._expect(":")
+            if name == self.key and self._peek() == "[":
+                self._pos += 1
+                if self._peek() == "]":
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._decode_value()
+                        if self._expect(",]") == "]":
+                            break
+            else:
+                self.meta[name] = self._decode_value()
+            if self._expect(",}") == "}":
+                return
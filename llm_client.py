@@ -3,6 +3,7 @@ import json
 import re
 import os
 from enum import Enum
+from admission_control import get_admission_controller
 
 class LLMProvider(Enum):
     OLLAMA = "ollama"
@@ -10,7 +11,7 @@ class LLMProvider(Enum):
     DEEPSEEK = "deepseek"
 
 class LLMClient:
-    def __init__(self, provider=LLMProvider.OPENROUTER, base_url=None, model=None, api_key=None):
+    def __init__(self, provider=LLMProvider.OPENROUTER, base_url=None, model=None, api_key=None, admission_controller=None):
         """
         初始化LLM客户端
         
@@ -19,8 +20,14 @@ class LLMClient:
             base_url (str, optional): API基础URL
             model (str, optional): 模型名称
             api_key (str, optional): API密钥(OpenRouter和DeepSeek需要)
+            admission_controller (AdmissionController, optional): LLM调用的准入控制器，默认使用进程内共享的控制器
         """
         self.provider = provider
+        self.admission_controller = admission_controller or get_admission_controller()
+        # 单次生成的超时时间（秒），Ollama卡住时及时释放准入控制的并发名额
+        self.request_timeout = float(os.environ.get("LLM_REQUEST_TIMEOUT", "60"))
+        # 预加载需要把模型读入显存，超时时间单独设置
+        self.preload_timeout = float(os.environ.get("LLM_PRELOAD_TIMEOUT", "300"))
         
         # OpenRouter配置 (默认启用)
         if provider == LLMProvider.OPENROUTER:
@@ -47,6 +54,8 @@ class LLMClient:
             self.model = model or "qwen2.5-coder:latest"
             self.api_key = None  # Ollama不需要API密钥
             self.api_url = f"{self.base_url}/api/generate"
+            # 模型在Ollama中的驻留时间，避免空闲后被卸载导致下次调用重新加载
+            self.keep_alive = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
             print(f"使用Ollama模式，API URL: {self.api_url}, 模型: {self.model}")
     
     def generate_sql(self, user_query, schema):
@@ -85,13 +94,42 @@ class LLMClient:
 ### 生成的SQL语句（请只输出纯SQL语句，不要有任何其他内容）：
 """
         
-        # 根据不同提供商调用不同的API
-        if self.provider == LLMProvider.OPENROUTER:
-            return self._call_openrouter_api(prompt)
-        # elif self.provider == LLMProvider.DEEPSEEK:
-        #     return self._call_deepseek_api(prompt)
-        else:  # Ollama
-            return self._call_ollama_api(prompt)
+        # 根据不同提供商调用不同的API，并发数和排队由准入控制器限制
+        with self.admission_controller.slot():
+            if self.provider == LLMProvider.OPENROUTER:
+                return self._call_openrouter_api(prompt)
+            # elif self.provider == LLMProvider.DEEPSEEK:
+            #     return self._call_deepseek_api(prompt)
+            else:  # Ollama
+                return self._call_ollama_api(prompt)
+    
+    def preload(self, keep_alive=None):
+        """
+        预加载模型，使首个真实查询无需等待模型加载
+        
+        Args:
+            keep_alive (str, optional): 模型驻留时间，默认使用OLLAMA_KEEP_ALIVE
+            
+        Returns:
+            bool: 是否预加载成功（非Ollama提供商无需预加载，直接返回True）
+        """
+        if self.provider != LLMProvider.OLLAMA:
+            return True
+        
+        # 不带prompt调用generate接口时，Ollama只加载模型而不做推理
+        data = {
+            "model": self.model,
+            "keep_alive": keep_alive or self.keep_alive
+        }
+        
+        try:
+            response = requests.post(self.api_url, json=data, timeout=self.preload_timeout)
+            response.raise_for_status()
+            print(f"模型已预加载: {self.model}")
+            return True
+        except Exception as e:
+            print(f"预加载Ollama模型时出错: {e}")
+            return False
     
     def _call_openrouter_api(self, prompt):
         """调用OpenRouter API"""
@@ -127,7 +165,8 @@ class LLMClient:
             response = requests.post(
                 self.api_url, 
                 json=data,  # 使用json参数自动处理编码
-                headers=headers
+                headers=headers,
+                timeout=self.request_timeout
             )
             
             response.raise_for_status()
@@ -182,11 +221,12 @@ class LLMClient:
         data = {
             "model": self.model,
             "prompt": prompt,
-            "stream": False
+            "stream": False,
+            "keep_alive": self.keep_alive
         }
         
         try:
-            response = requests.post(self.api_url, json=data)
+            response = requests.post(self.api_url, json=data, timeout=self.request_timeout)
             response.raise_for_status()
             result = response.json()
             sql = result.get("response", "").strip()
@@ -0,0 +1,157 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from result_cache import get_data_version, set_data_version
+from schema_registry import DEFAULT_TABLE
+
+class PrewarmScheduler:
+    def __init__(self, java_api_client, query_log, on_result=None, claim_cache=None,
+                 enabled=None, top_n=None, concurrency=None, poll_interval=None):
+        """
+        初始化缓存预热调度器
+
+        后台定时检查stock_business的最新交易日，出现新数据时更新数据版本，
+        并通过JavaAPIClient.execute_sql重新执行查询日志中最常用的SQL，在分析师使用前填充结果缓存。
+
+        Args:
+            java_api_client (JavaAPIClient): Java API客户端
+            query_log (QueryLog): 查询日志
+            on_result (callable, optional): 每个查询预热成功后的回调，参数为(查询, SQL, 执行结果)
+            claim_cache (optional): 多个worker共用的缓存，同一数据版本只由一个worker预热
+            enabled (bool, optional): 是否启用，默认读取PREWARM_ENABLED
+            top_n (int, optional): 预热的查询数量，默认读取PREWARM_TOP_N
+            concurrency (int, optional): 同时执行的查询数，默认读取PREWARM_CONCURRENCY
+            poll_interval (float, optional): 检查新数据的间隔（秒），默认读取PREWARM_POLL_INTERVAL
+        """
+        if enabled is None:
+            enabled = os.environ.get("PREWARM_ENABLED", "True").lower() == "true"
+        self.enabled = enabled
+        self.java_api_client = java_api_client
+        self.query_log = query_log
+        self.on_result = on_result
+        self.claim_cache = claim_cache
+        self.top_n = top_n or int(os.environ.get("PREWARM_TOP_N", "50"))
+        self.concurrency = concurrency or int(os.environ.get("PREWARM_CONCURRENCY", "2"))
+        self.poll_interval = poll_interval or float(os.environ.get("PREWARM_POLL_INTERVAL", "300"))
+        # 只预热最近这么多天内出现过的查询
+        self.max_age = float(os.environ.get("PREWARM_MAX_AGE_DAYS", "14")) * 86400
+        self.latest_trade_date = None
+        self.last_run = None
+        self._running = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """启动后台检查线程"""
+        if not self.enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="prewarm", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                print(f"检查新交易日数据时出错: {e}")
+            if self._stop.wait(self.poll_interval):
+                return
+
+    def detect_latest_trade_date(self):
+        """查询最新交易日，不读取缓存"""
+        result = self.java_api_client.execute_sql(
+            f"SELECT MAX(trade_date) AS max_date FROM {DEFAULT_TABLE}", use_cache=False
+        )
+        if result.get("code") != 0 or not result.get("data"):
+            raise RuntimeError(result.get("msg", "查询最新交易日失败"))
+        return str(list(result["data"][0].values())[0])
+
+    def check(self):
+        """
+        检查是否有新交易日数据，有则更新数据版本并预热
+
+        Returns:
+            bool: 是否执行了预热
+        """
+        latest = self.detect_latest_trade_date()
+        if latest == self.latest_trade_date:
+            return False
+        # 首次检查（进程启动）时同样需要预热：缓存可能是空的，也可能属于旧版本
+        print(f"检测到最新交易日: {latest}（之前为 {self.latest_trade_date}）")
+        self.latest_trade_date = latest
+        set_data_version(latest)
+
+        if self.claim_cache is not None:
+            # 原子认领：多个worker同时启动时只有一个认领成功，其余跳过，结果缓存由它填充
+            if not self.claim_cache.add(f"prewarm:{latest}", os.getpid()):
+                print(f"交易日 {latest} 的缓存预热已由其他进程执行")
+                return False
+        self.run()
+        return True
+
+    def run(self):
+        """
+        重新执行最常用的SQL，填充当前数据版本的结果缓存
+
+        Returns:
+            dict: 预热报告，正在预热时返回None
+        """
+        if not self._running.acquire(blocking=False):
+            return None
+        try:
+            return self._run()
+        finally:
+            self._running.release()
+
+    def _run(self):
+        version = get_data_version()
+        queries, total = self.query_log.top(self.top_n, self.max_age)
+        start = time.time()
+        print(f"开始预热数据版本 {version} 的缓存，共{len(queries)}个查询")
+
+        def warm(item):
+            user_query, sql, count = item
+            query_start = time.time()
+            try:
+                result = self.java_api_client.execute_sql(sql, use_cache=False)
+                ok = result.get("code") == 0
+                if ok and self.on_result:
+                    self.on_result(user_query, sql, result)
+            except Exception as e:
+                print(f"预热查询 {user_query} 出错: {e}")
+                ok = False
+            return ok, count, time.time() - query_start
+
+        # 并发数受限，避免预热占满Java API
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="prewarm") as executor:
+            outcomes = list(executor.map(warm, queries))
+
+        succeeded = [outcome for outcome in outcomes if outcome[0]]
+        warmed_count = sum(count for _, count, _ in succeeded)
+        self.last_run = {
+            "data_version": version,
+            "started_at": start,
+            "duration": round(time.time() - start, 3),
+            "queries": len(queries),
+            "succeeded": len(succeeded),
+            "failed": len(queries) - len(succeeded),
+            "slowest_query": round(max((elapsed for _, _, elapsed in outcomes), default=0), 3),
+            # 预热成功的查询占查询日志中历史查询次数的比例，即预计能直接命中缓存的请求比例
+            "coverage": round(warmed_count / total, 3) if total else None
+        }
+        print(f"缓存预热完成: {self.last_run}")
+        return self.last_run
+
+    def get_status(self):
+        """预热状态和最近一次预热的报告"""
+        return {
+            "enabled": self.enabled,
+            "latest_trade_date": self.latest_trade_date,
+            "data_version": get_data_version(),
+            "running": self._running.locked(),
+            "last_run": self.last_run
+        }
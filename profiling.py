@@ -0,0 +1,208 @@
+import io
+import os
+import sys
+import hmac
+import time
+import uuid
+import marshal
+import pstats
+import cProfile
+import itertools
+import threading
+from collections import Counter, deque
+from functools import wraps
+from flask import request, make_response
+
+# 性能分析方式
+PROFILE_MODES = ("cprofile", "sample")
+
+class _StackSampler:
+    """定时采样指定线程的调用栈，开销与采样间隔相关、与函数调用次数无关"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+class QueryProfiler:
+    def __init__(self, sample_rate=None, max_profiles=None, mode=None, sample_interval=None):
+        """
+        初始化查询流水线的性能分析器
+
+        Args:
+            sample_rate (int, optional): 每N个请求分析一次，0表示只分析带X-Profile请求头的请求，默认读取PROFILE_SAMPLE_RATE
+            max_profiles (int, optional): 保留的分析结果数量，默认读取PROFILE_MAX_PROFILES
+            mode (str, optional): 按比例抽样时的分析方式，cprofile或sample，默认读取PROFILE_MODE
+            sample_interval (float, optional): sample方式的采样间隔（秒），默认读取PROFILE_SAMPLE_INTERVAL
+        """
+        self.sample_rate = sample_rate if sample_rate is not None else int(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+        self.mode = mode or os.environ.get("PROFILE_MODE", "sample")
+        self.sample_interval = sample_interval or float(os.environ.get("PROFILE_SAMPLE_INTERVAL", "0.005"))
+        # 环形缓冲区，超出数量后丢弃最早的分析结果
+        self.profiles = deque(maxlen=max_profiles or int(os.environ.get("PROFILE_MAX_PROFILES", "50")))
+        self._counter = itertools.count(1)
+        # cProfile同一时间只能有一个在运行
+        self._cprofile_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    def select_mode(self):
+        """
+        判断当前请求是否需要分析
+
+        Returns:
+            str: 分析方式，不需要分析时返回None
+        """
+        header = request.headers.get("X-Profile", "").lower()
+        if header and header not in ("0", "false") and is_admin_request():
+            return header if header in PROFILE_MODES else "cprofile"
+        if self.sample_rate > 0 and next(self._counter) % self.sample_rate == 0:
+            return self.mode
+        return None
+
+    def profiled(self, name):
+        """
+        视图函数装饰器，对需要分析的请求运行性能分析，并在响应头X-Profile-Id中返回分析结果编号
+
+        Args:
+            name (str): 分析结果的名称
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                mode = self.select_mode()
+                if mode is None:
+                    return view(*args, **kwargs)
+
+                data = request.get_json(silent=True) or {}
+                label = data.get("query") or data.get("sql") or request.path
+                profile_id, response = self.run(name, label, mode, view, *args, **kwargs)
+                response = make_response(response)
+                if profile_id:
+                    response.headers["X-Profile-Id"] = profile_id
+                return response
+            return wrapper
+        return decorator
+
+    def run(self, name, label, mode, func, *args, **kwargs):
+        """
+        在性能分析下执行函数并保存结果
+
+        Returns:
+            tuple: (分析结果编号, 函数返回值)，cProfile正被占用时不分析，编号为None
+        """
+        if mode == "cprofile":
+            if not self._cprofile_lock.acquire(blocking=False):
+                return None, func(*args, **kwargs)
+            profiler = cProfile.Profile()
+            start = time.time()
+            try:
+                result = profiler.runcall(func, *args, **kwargs)
+            finally:
+                duration = time.time() - start
+                self._cprofile_lock.release()
+            profiler.create_stats()
+            data = marshal.dumps(profiler.stats)
+        else:
+            sampler = _StackSampler(threading.get_ident(), self.sample_interval)
+            start = time.time()
+            sampler.start()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                sampler.stop()
+                duration = time.time() - start
+            data = "\n".join(f"{stack} {count}" for stack, count in sampler.stacks.most_common()).encode("utf-8")
+
+        profile_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self.profiles.append({
+                "id": profile_id,
+                "name": name,
+                "label": label,
+                "mode": mode,
+                "created_at": start,
+                "duration": round(duration, 4),
+                "size": len(data),
+                "data": data
+            })
+        print(f"已保存性能分析结果 {profile_id}（{mode}），耗时 {duration:.3f}s: {label}")
+        return profile_id, result
+
+    def list_profiles(self):
+        """列出环形缓冲区中的分析结果（不含数据），最新的在前"""
+        with self._lock:
+            return [
+                {key: value for key, value in profile.items() if key != "data"}
+                for profile in reversed(self.profiles)
+            ]
+
+    def get_profile(self, profile_id):
+        """按编号获取分析结果，不存在时返回None"""
+        with self._lock:
+            for profile in self.profiles:
+                if profile["id"] == profile_id:
+                    return profile
+        return None
+
+def render_profile(profile, fmt=None):
+    """
+    将分析结果转换为可下载的内容
+
+    Args:
+        profile (dict): 分析结果
+        fmt (str, optional): cprofile结果可选pstats（二进制，可用pstats/snakeviz打开）或text（按累计耗时排序的文本）；
+            sample结果为collapsed格式，可直接用flamegraph.pl生成火焰图
+
+    Returns:
+        tuple: (内容, mimetype, 文件扩展名)
+    """
+    if profile["mode"] == "sample":
+        return profile["data"], "text/plain", "collapsed"
+
+    if fmt == "text":
+        stream = io.StringIO()
+        stats = pstats.Stats(_MarshalledStats(profile["data"]), stream=stream)
+        stats.sort_stats("cumulative").print_stats(50)
+        return stream.getvalue(), "text/plain", "txt"
+    return profile["data"], "application/octet-stream", "pstats"
+
+class _MarshalledStats:
+    """让pstats.Stats直接读取序列化后的分析结果"""
+
+    def __init__(self, data):
+        self.stats = marshal.loads(data)
+
+    def create_stats(self):
+        pass
+
+def is_admin_request():
+    """
+    请求是否通过X-Admin-Token请求头提供了与ADMIN_TOKEN一致的令牌
+
+    未配置ADMIN_TOKEN时管理接口和X-Profile请求头一律不可用；令牌不从查询参数读取，避免写入访问日志。
+    """
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    if not admin_token:
+        return False
+    return hmac.compare_digest(request.headers.get("X-Admin-Token", ""), admin_token)
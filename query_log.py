@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+
+# fcntl只在类Unix系统上可用，用于多个worker进程之间的文件锁
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+class QueryLog:
+    def __init__(self, path=None, max_lines=None, max_queries=None, max_pending=None):
+        """
+        初始化查询日志，记录每个自然语言查询的次数和最终执行的SQL
+
+        日志文件只追加，每次查询写一行；文件超过max_lines行时合并为每个查询一行（次数、最近的SQL和时间），
+        多个worker进程可以共用同一个文件。请求线程只把记录放入队列，由后台线程批量写入。
+
+        Args:
+            path (str, optional): 日志文件路径，默认读取QUERY_LOG_PATH
+            max_lines (int, optional): 触发合并的文件行数，默认读取QUERY_LOG_MAX_LINES
+            max_queries (int, optional): 合并时最多保留的查询数，默认读取QUERY_LOG_MAX_QUERIES
+            max_pending (int, optional): 等待写入的记录上限，超出时丢弃新记录，默认读取QUERY_LOG_MAX_PENDING
+        """
+        self.path = path or os.environ.get("QUERY_LOG_PATH", "query_log.jsonl")
+        self.max_lines = max_lines or int(os.environ.get("QUERY_LOG_MAX_LINES", "10000"))
+        self.max_queries = max_queries or int(os.environ.get("QUERY_LOG_MAX_QUERIES", "5000"))
+        # 合并时用新文件替换日志文件，文件锁加在单独的锁文件上
+        self.lock_path = self.path + ".lock"
+        self._pending = queue.Queue(maxsize=max_pending or int(os.environ.get("QUERY_LOG_MAX_PENDING", "10000")))
+        self._lock = threading.Lock()
+        self._writer = None
+        self._dropped = 0
+        # 已统计行数的文件位置：(inode, 偏移, 行数)，其他进程追加的行从偏移处继续统计
+        self._counted = None
+
+    def _locked(self, exclusive):
+        """加文件锁，返回锁文件对象，关闭时释放"""
+        handle = open(self.lock_path, "a")
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return handle
+
+    def record(self, user_query, sql):
+        """
+        记录一次查询，只放入队列，不等待写入
+
+        Args:
+            user_query (str): 用户的自然语言查询
+            sql (str): 查询最终执行的SQL
+        """
+        line = json.dumps({"q": user_query.strip(), "sql": sql, "t": round(time.time(), 3)}, ensure_ascii=False) + "\n"
+        self._ensure_writer()
+        try:
+            self._pending.put_nowait(line)
+        except queue.Full:
+            # 写入跟不上时丢弃记录，不阻塞请求
+            with self._lock:
+                self._dropped += 1
+
+    def _ensure_writer(self):
+        if self._writer is not None:
+            return
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="query-log-writer", daemon=True)
+                self._writer.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            lines = [self._pending.get()]
+            # 一次取出队列中已有的所有记录，一起写入
+            while True:
+                try:
+                    lines.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(lines)
+            except Exception as e:
+                print(f"写入查询日志时出错: {e}")
+            finally:
+                for _ in lines:
+                    self._pending.task_done()
+
+    def flush(self):
+        """等待队列中的记录全部写入"""
+        if self._writer is not None:
+            self._pending.join()
+
+    def _write(self, lines):
+        """追加一批记录，文件行数超过max_lines时合并"""
+        with self._locked(exclusive=True):
+            line_count = self._count_lines()
+            with open(self.path, "a", encoding="utf-8") as handle:
+                handle.write("".join(lines))
+                handle.flush()
+                stat = os.fstat(handle.fileno())
+            line_count += len(lines)
+            self._counted = (stat.st_ino, stat.st_size, line_count)
+            if line_count >= self.max_lines:
+                self._compact()
+
+    def _count_lines(self):
+        """统计日志文件的行数，包括其他进程写入的行；调用方需持有文件锁"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return 0
+        inode, offset, line_count = self._counted or (None, 0, 0)
+        if inode != stat.st_ino or stat.st_size < offset:
+            # 文件被其他进程合并替换过，重新统计
+            offset, line_count = 0, 0
+        with open(self.path, "rb") as handle:
+            handle.seek(offset)
+            for chunk in iter(lambda: handle.read(1 << 20), b""):
+                line_count += chunk.count(b"\n")
+        return line_count
+
+    def _read(self, handle):
+        """重放日志，返回查询 -> {"sql", "count", "last"}"""
+        entries = {}
+        for line in handle:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 进程异常退出时可能留下不完整的行
+                continue
+            entry = entries.setdefault(record["q"], {"sql": record["sql"], "count": 0, "last": 0})
+            entry["count"] += record.get("n", 1)
+            if record["t"] >= entry["last"]:
+                entry["last"] = record["t"]
+                entry["sql"] = record["sql"]
+        return entries
+
+    def load(self):
+        """读取所有查询的统计信息"""
+        with self._locked(exclusive=False):
+            if not os.path.exists(self.path):
+                return {}
+            with open(self.path, "r", encoding="utf-8") as handle:
+                return self._read(handle)
+
+    def compact(self):
+        """将日志合并为每个查询一行，只保留次数最多的max_queries个查询"""
+        with self._locked(exclusive=True):
+            self._compact()
+
+    def _compact(self):
+        """合并日志；调用方需持有排他文件锁"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as handle:
+            entries = self._read(handle)
+        kept = sorted(entries.items(), key=lambda item: (item[1]["count"], item[1]["last"]), reverse=True)[:self.max_queries]
+        # 先写入临时文件再替换，进程中途退出时不会丢失日志
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as handle:
+            for query, entry in kept:
+                handle.write(json.dumps({"q": query, "sql": entry["sql"], "n": entry["count"], "t": entry["last"]}, ensure_ascii=False) + "\n")
+        os.replace(temp_path, self.path)
+        stat = os.stat(self.path)
+        self._counted = (stat.st_ino, stat.st_size, len(kept))
+        print(f"查询日志已合并，保留{len(kept)}个查询")
+
+    def get_metrics(self):
+        """
+        获取查询日志指标
+
+        Returns:
+            dict: 等待写入和因队列已满丢弃的记录数
+        """
+        with self._lock:
+            return {"pending": self._pending.qsize(), "dropped": self._dropped}
+
+    def top(self, n, max_age=None):
+        """
+        获取最常用的查询
+
+        Args:
+            n (int): 返回的查询数量
+            max_age (float, optional): 只统计最近max_age秒内出现过的查询
+
+        Returns:
+            tuple: ([(查询, SQL, 次数), ...], 统计范围内的总查询次数)
+        """
+        entries = self.load()
+        if max_age:
+            cutoff = time.time() - max_age
+            entries = {query: entry for query, entry in entries.items() if entry["last"] >= cutoff}
+        ranked = sorted(entries.items(), key=lambda item: item[1]["count"], reverse=True)[:n]
+        total = sum(entry["count"] for entry in entries.values())
+        return [(query, entry["sql"], entry["count"]) for query, entry in ranked], total
@@ -0,0 +1,176 @@
+import os
+import re
+import time
+import threading
+
+# 模型档位
+TIER_SMALL = "small"
+TIER_LARGE = "large"
+
+# 复杂度特征使用的关键词
+_COMPARISON_PATTERN = re.compile(r'大于等于|小于等于|不低于|不少于|不高于|不超过|大于|高于|超过|多于|小于|低于|少于|等于|>=|<=|>|<|=')
+_RANGE_PATTERN = re.compile(r'介于|之间|\d+\s*(?:到|至|~|-)\s*\d+')
+_AND_PATTERN = re.compile(r'并且|而且|同时|以及|且|和|与|[，,、]|\band\b', re.IGNORECASE)
+_OR_PATTERN = re.compile(r'或者|或是|或|\bor\b', re.IGNORECASE)
+_AGGREGATION_PATTERN = re.compile(r'平均|均值|总和|合计|总计|求和|统计|汇总|分组|每个|各个|按行业|按地区|数量|多少只|多少家|占比|比例|\b(?:count|sum|avg|group\s+by)\b', re.IGNORECASE)
+_SORTING_PATTERN = re.compile(r'排序|排名|排行|前\s*\d+|后\s*\d+|top\s*\d+|最高的|最低的|最大的|最小的|最多的|最少的|降序|升序|\border\s+by\b', re.IGNORECASE)
+_TEMPORAL_PATTERN = re.compile(r'连续|\d+\s*(?:日|天|周|个月)内|昨天|前一(?:日|天)|上周|上个月|同比|环比|历史|期间|以来|趋势')
+_NEGATION_PATTERN = re.compile(r'不是|不包括|除了|排除|非')
+
+def extract_features(user_query, fields):
+    """
+    提取查询的复杂度特征
+
+    Args:
+        user_query (str): 用户的自然语言查询
+        fields (list): 查询中引用的数据库字段
+
+    Returns:
+        dict: 特征名 -> 数值
+    """
+    return {
+        "fields": len(set(fields)),
+        "comparisons": len(_COMPARISON_PATTERN.findall(user_query)),
+        "conjunctions": len(_AND_PATTERN.findall(user_query.strip("，,、。 "))),
+        "disjunctions": len(_OR_PATTERN.findall(user_query)),
+        "ranges": len(_RANGE_PATTERN.findall(user_query)),
+        "aggregation": len(_AGGREGATION_PATTERN.findall(user_query)),
+        "sorting": len(_SORTING_PATTERN.findall(user_query)),
+        "temporal": len(_TEMPORAL_PATTERN.findall(user_query)),
+        "negation": len(_NEGATION_PATTERN.findall(user_query)),
+        "length": len(user_query)
+    }
+
+# 特征权重：字段和条件超过两个的部分才计分，聚合、排序、跨时间、或条件、区间条件直接计入较高分数
+FEATURE_WEIGHTS = {
+    "fields": (1, 2),        # (权重, 免计分数量)
+    "comparisons": (1, 2),
+    "conjunctions": (0.5, 1),
+    "disjunctions": (2, 0),
+    "ranges": (2, 0),
+    "aggregation": (3, 0),
+    "sorting": (3, 0),
+    "temporal": (3, 0),
+    "negation": (2, 0)
+}
+
+def complexity_score(features):
+    """按特征权重计算复杂度得分"""
+    score = 0
+    for name, (weight, free) in FEATURE_WEIGHTS.items():
+        score += weight * max(0, features[name] - free)
+    # 较长的查询通常包含更多隐含条件
+    if features["length"] > 60:
+        score += 1
+    return score
+
+class ModelRouter:
+    def __init__(self, large_client, small_client=None, enabled=None, max_simple_score=None):
+        """
+        初始化按查询复杂度选择模型的路由器
+
+        简单查询（单个或少量条件）使用小模型，包含聚合、排序、跨时间、或条件等的复杂查询使用大模型；
+        小模型生成的SQL校验不通过时改用大模型重新生成。
+
+        Args:
+            large_client (LLMClient): 大模型客户端
+            small_client (LLMClient, optional): 小模型客户端，为None时所有查询使用大模型
+            enabled (bool, optional): 是否启用路由，默认读取MODEL_ROUTING_ENABLED
+            max_simple_score (float, optional): 复杂度得分不超过该值时使用小模型，默认读取ROUTING_MAX_SIMPLE_SCORE
+        """
+        if enabled is None:
+            enabled = os.environ.get("MODEL_ROUTING_ENABLED", "False").lower() == "true"
+        self.enabled = enabled and small_client is not None
+        self.large_client = large_client
+        self.small_client = small_client
+        self.max_simple_score = max_simple_score if max_simple_score is not None else float(os.environ.get("ROUTING_MAX_SIMPLE_SCORE", "1"))
+        self._lock = threading.Lock()
+        self._stats = {
+            TIER_SMALL: {"requests": 0, "latency": 0.0, "invalid": 0},
+            TIER_LARGE: {"requests": 0, "latency": 0.0, "invalid": 0}
+        }
+        self._escalations = 0
+
+    def classify(self, user_query, fields):
+        """
+        判断查询应使用的模型档位
+
+        Returns:
+            tuple: (档位, 复杂度得分, 特征)
+        """
+        features = extract_features(user_query, fields)
+        score = complexity_score(features)
+        tier = TIER_SMALL if self.enabled and score <= self.max_simple_score else TIER_LARGE
+        return tier, score, features
+
+    def _call(self, tier, user_query, schema, validate):
+        client = self.small_client if tier == TIER_SMALL else self.large_client
+        start = time.time()
+        sql = client.generate_sql(user_query, schema)
+        valid = bool(sql) and (validate is None or validate(sql))
+        with self._lock:
+            stats = self._stats[tier]
+            stats["requests"] += 1
+            stats["latency"] += time.time() - start
+            if not valid:
+                stats["invalid"] += 1
+        return sql, valid
+
+    def generate_sql(self, user_query, schema, fields=(), validate=None):
+        """
+        选择模型生成SQL，小模型的结果校验失败时升级到大模型
+
+        Args:
+            user_query (str): 用户的自然语言查询
+            schema (str): 表结构
+            fields (list): 查询中引用的数据库字段
+            validate (callable, optional): 校验生成的SQL，返回False表示无效
+
+        Returns:
+            str: 生成的SQL语句
+        """
+        tier, score, features = self.classify(user_query, fields)
+        print(f"查询复杂度 {score}，使用{'小' if tier == TIER_SMALL else '大'}模型: {user_query}")
+        sql, valid = self._call(tier, user_query, schema, validate)
+        if valid or tier == TIER_LARGE:
+            return sql
+
+        print(f"小模型生成的SQL未通过校验，改用大模型: {sql}")
+        with self._lock:
+            self._escalations += 1
+        sql, _ = self._call(TIER_LARGE, user_query, schema, validate)
+        return sql
+
+    def models(self):
+        """可能用于生成SQL的模型名称"""
+        if self.enabled:
+            return self.large_client.model, self.small_client.model
+        return (self.large_client.model,)
+
+    def preload(self):
+        """预加载路由涉及的所有模型"""
+        ok = self.large_client.preload()
+        if self.enabled:
+            ok = self.small_client.preload() and ok
+        return ok
+
+    def get_metrics(self):
+        """各档位的调用次数、平均耗时、校验失败次数和升级次数"""
+        with self._lock:
+            tiers = {}
+            for tier, stats in self._stats.items():
+                client = self.small_client if tier == TIER_SMALL else self.large_client
+                tiers[tier] = {
+                    "model": client.model if client else None,
+                    "requests": stats["requests"],
+                    "avg_latency": round(stats["latency"] / stats["requests"], 3) if stats["requests"] else None,
+                    "invalid": stats["invalid"]
+                }
+            small_requests = self._stats[TIER_SMALL]["requests"]
+            return {
+                "enabled": self.enabled,
+                "max_simple_score": self.max_simple_score,
+                "tiers": tiers,
+                "escalations": self._escalations,
+                "escalation_rate": round(self._escalations / small_requests, 3) if small_requests else None
+            }
@@ -0,0 +1,157 @@
+import os
+import gzip
+import json
+import hashlib
+from flask import request, Response
+from result_cache import TTLCache
+
+# 可选依赖：brotli压缩和MessagePack编码
+try:
+    import brotli
+    use_brotli = True
+except ImportError:
+    use_brotli = False
+
+try:
+    import msgpack
+    use_msgpack = True
+except ImportError:
+    use_msgpack = False
+
+# 响应格式 -> Content-Type
+FORMAT_MIMETYPES = {
+    "json": "application/json",                           # 原始格式，每行一个对象
+    "columnar": "application/vnd.text2sql.columnar+json",  # 列式JSON，字段名只出现一次
+    "msgpack": "application/x-msgpack"                     # 列式MessagePack
+}
+
+# 小于该大小（字节）的响应不压缩
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+
+# 已编码、压缩的响应体，重复查看同一结果时无需重新编码
+_encoded_cache = TTLCache(
+    max_entries=int(os.environ.get("ENCODED_CACHE_MAX_ENTRIES", "200")),
+    ttl=int(os.environ.get("QUERY_CACHE_TTL", "28800"))
+)
+
+def to_columnar(result):
+    """
+    将Java API返回结果中的data转换为列式结构
+
+    Args:
+        result (dict): Java API返回结果，data为行对象列表
+
+    Returns:
+        dict: data替换为{"columns": [...], "rows": [[...], ...]}的结果
+    """
+    rows = result.get("data") or []
+    columns = []
+    seen = set()
+    for row in rows:
+        for key in row:
+            if key not in seen:
+                seen.add(key)
+                columns.append(key)
+
+    compact = dict(result)
+    compact["data"] = {
+        "columns": columns,
+        "rows": [[row.get(column) for column in columns] for row in rows]
+    }
+    return compact
+
+def negotiate_format():
+    """
+    根据format参数或Accept请求头选择响应格式
+
+    Returns:
+        str: json、columnar或msgpack（需要安装msgpack）
+    """
+    fmt = request.args.get("format")
+    if fmt not in FORMAT_MIMETYPES:
+        best = request.accept_mimetypes.best_match(list(FORMAT_MIMETYPES.values()), default=FORMAT_MIMETYPES["json"])
+        fmt = next(name for name, mimetype in FORMAT_MIMETYPES.items() if mimetype == best)
+    if fmt == "msgpack" and not use_msgpack:
+        fmt = "columnar"
+    return fmt
+
+def negotiate_encoding():
+    """根据Accept-Encoding请求头选择压缩方式，优先brotli"""
+    accepted = request.accept_encodings
+    if use_brotli and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+def compute_etag(payload):
+    """根据响应内容计算ETag"""
+    body = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(body.encode("utf-8")).hexdigest()
+
+def encode_payload(payload, fmt):
+    """
+    按指定格式编码响应内容
+
+    Args:
+        payload (dict): 包含sql和result的响应内容
+        fmt (str): 响应格式
+
+    Returns:
+        bytes: 编码后的响应体
+    """
+    if fmt != "json" and isinstance(payload.get("result"), dict):
+        payload = dict(payload, result=to_columnar(payload["result"]))
+    if fmt == "msgpack":
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def compress(body, encoding):
+    """压缩响应体"""
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+def make_compact_response(payload, etag=None):
+    """
+    生成经过内容协商和压缩的响应
+
+    请求的If-None-Match与ETag一致时返回304。
+
+    Args:
+        payload (dict): 响应内容
+        etag (str, optional): 响应内容的ETag，为None时不启用条件请求
+
+    Returns:
+        Response: Flask响应
+    """
+    if etag and request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        fmt = negotiate_format()
+        encoding = negotiate_encoding()
+
+        cache_key = (etag, fmt, encoding) if etag else None
+        cached = _encoded_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            body, encoding = cached
+        else:
+            body = encode_payload(payload, fmt)
+            if len(body) < COMPRESSION_MIN_SIZE:
+                encoding = None
+            body = compress(body, encoding)
+            if cache_key:
+                _encoded_cache.set(cache_key, (body, encoding))
+
+        response = Response(body, mimetype=FORMAT_MIMETYPES[fmt])
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+
+    response.headers["Vary"] = "Accept, Accept-Encoding"
+    if etag:
+        response.set_etag(etag, weak=True)
+        # 浏览器每次都带上If-None-Match重新验证
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response
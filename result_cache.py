@@ -0,0 +1,89 @@
+import time
+import datetime
+import threading
+from collections import OrderedDict
+
+# 当前数据版本，默认为当天日期；检测到新交易日数据时可以显式设置
+_data_version = None
+
+def get_data_version():
+    """
+    获取当前数据版本，用于缓存键
+
+    Returns:
+        str: 显式设置的数据版本（如最新trade_date），未设置时为当天日期
+    """
+    return _data_version or datetime.date.today().isoformat()
+
+def set_data_version(version):
+    """设置当前数据版本，旧版本的缓存随之失效"""
+    global _data_version
+    _data_version = str(version) if version else None
+
+class TTLCache:
+    def __init__(self, max_entries=1000, ttl=3600):
+        """
+        初始化进程内缓存，按最近最少使用淘汰，条目超过有效期后失效
+
+        Args:
+            max_entries (int): 最大条目数
+            ttl (float): 默认有效期（秒）
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key):
+        """获取缓存值，不存在或已过期时返回None"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._misses += 1
+                return None
+            value, expires_at = item
+            if expires_at < time.time():
+                del self._data[key]
+                self._misses += 1
+                return None
+            self._data.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        with self._lock:
+            self._data[key] = (value, time.time() + (ttl or self.ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def add(self, key, value, ttl=None):
+        """键不存在（或已过期）时写入，返回是否写入成功"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] >= time.time():
+                return False
+            self._data[key] = (value, time.time() + (ttl or self.ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+            return True
+
+    def delete(self, key):
+        """删除缓存条目"""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def get_metrics(self):
+        """获取缓存命中统计"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._data),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else None
+            }
@@ -0,0 +1,124 @@
+import io
+import csv
+
+# 可选依赖：Parquet导出
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    use_parquet = True
+except ImportError:
+    use_parquet = False
+
+# 导出格式 -> (Content-Type, 文件扩展名)
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet")
+}
+
+def iter_csv(rows, chunk_rows=1000):
+    """
+    将结果行流式编码为CSV
+
+    Args:
+        rows (iterable): 行对象迭代器，表头取第一行的字段
+        chunk_rows (int): 每个输出分块包含的行数
+
+    Yields:
+        bytes: CSV分块，第一个分块带UTF-8 BOM以便Excel正确识别中文
+    """
+    buffer = io.StringIO()
+    writer = None
+    count = 0
+    buffer.write("\ufeff")
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(row.keys()), extrasaction="ignore")
+            writer.writeheader()
+        writer.writerow(row)
+        count += 1
+        if count % chunk_rows == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+class _ChunkSink(io.RawIOBase):
+    """ParquetWriter的输出目标，写入的数据暂存后由调用方取走"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def _infer_schema(batch):
+    """根据第一批数据推断Parquet表结构：整数统一为float64，全为空的列为string，避免后续批次类型不一致"""
+    fields = []
+    for field in pa.Table.from_pylist(batch).schema:
+        if pa.types.is_integer(field.type):
+            field = field.with_type(pa.float64())
+        elif pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    return pa.schema(fields)
+
+def _to_table(batch, schema):
+    columns = {}
+    for field in schema:
+        values = [row.get(field.name) for row in batch]
+        if pa.types.is_string(field.type):
+            values = [None if value is None else str(value) for value in values]
+        columns[field.name] = values
+    return pa.Table.from_pydict(columns, schema=schema)
+
+def iter_parquet(rows, batch_rows=10000):
+    """
+    将结果行流式编码为Parquet，每批数据写为一个row group后立即输出
+
+    Args:
+        rows (iterable): 行对象迭代器
+        batch_rows (int): 每个row group的行数
+
+    Yields:
+        bytes: Parquet文件分块
+    """
+    sink = _ChunkSink()
+    writer = None
+    schema = None
+    batch = []
+
+    def write_batch():
+        nonlocal writer, schema
+        if schema is None:
+            schema = _infer_schema(batch)
+            writer = pq.ParquetWriter(sink, schema)
+        writer.write_table(_to_table(batch, schema))
+        batch.clear()
+
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_rows:
+            write_batch()
+            yield sink.drain()
+    if batch:
+        write_batch()
+    if writer is None:
+        # 没有数据时输出不含字段的空文件
+        writer = pq.ParquetWriter(sink, pa.schema([]))
+    writer.close()
+    yield sink.drain()
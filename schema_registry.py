@@ -0,0 +1,334 @@
+import os
+import re
+import csv
+import json
+import glob
+import threading
+from collections import OrderedDict
+from schema_knowledge import STOCK_BUSINESS_SCHEMA
+
+DEFAULT_TABLE = "stock_business"
+
+_CREATE_TABLE_PATTERN = re.compile(r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?`?(\w+)`?', re.IGNORECASE)
+_TABLE_COMMENT_PATTERN = re.compile(r"\)\s*[^;]*?COMMENT\s*=?\s*'([^']*)'\s*;?\s*$", re.IGNORECASE | re.DOTALL)
+# 轻量扫描：只提取字段名和注释，用于建立别名索引
+_COLUMN_ALIAS_PATTERN = re.compile(r"^\s*`(\w+)`[^\n]*?COMMENT\s+'([^']*)'", re.MULTILINE)
+# 完整解析：字段名、类型、注释
+_COLUMN_PATTERN = re.compile(
+    r"^\s*`(?P<name>\w+)`\s+(?P<type>\w+(?:\([^)]*\))?)[^\n]*?(?:COMMENT\s+'(?P<comment>[^']*)')?\s*,?\s*$",
+    re.MULTILINE
+)
+_PARENTHESES_PATTERN = re.compile(r'[（(].*?[）)]')
+
+def comment_to_alias(comment):
+    """从字段注释中提取别名，去掉括号中的补充说明，如'换手率（%）' -> '换手率'"""
+    return _PARENTHESES_PATTERN.sub('', comment or '').strip()
+
+class TableSchema:
+    def __init__(self, name, ddl=None, columns=None, comment=''):
+        """
+        初始化表结构，DDL在首次访问字段信息时才解析
+
+        Args:
+            name (str): 表名
+            ddl (str, optional): 建表语句
+            columns (list, optional): 字段列表，每项为(字段名, 类型, 注释)，来自information_schema时使用
+            comment (str, optional): 表注释
+        """
+        self.name = name
+        self.comment = comment
+        self._ddl = ddl
+        self._raw_columns = columns
+        self._columns = None
+        self._aliases = {}
+        self._alias_index = None
+        self._lock = threading.Lock()
+
+    @property
+    def columns(self):
+        """字段索引：字段名 -> {'type': 类型, 'comment': 注释}"""
+        if self._columns is None:
+            with self._lock:
+                if self._columns is None:
+                    self._columns = self._parse()
+        return self._columns
+
+    def _parse(self):
+        columns = OrderedDict()
+        if self._raw_columns is not None:
+            for name, column_type, comment in self._raw_columns:
+                columns[name] = {"type": column_type, "comment": comment or ''}
+        elif self._ddl:
+            for match in _COLUMN_PATTERN.finditer(self._ddl):
+                columns[match.group('name')] = {
+                    "type": match.group('type'),
+                    "comment": match.group('comment') or ''
+                }
+        return columns
+
+    @property
+    def ddl(self):
+        """建表语句，来自information_schema的表按字段信息生成"""
+        if self._ddl is None:
+            lines = [
+                f"  `{name}` {info['type']}" + (f" COMMENT '{info['comment']}'" if info['comment'] else '')
+                for name, info in self.columns.items()
+            ]
+            table_comment = f" COMMENT='{self.comment}'" if self.comment else ''
+            self._ddl = f"CREATE TABLE `{self.name}` (\n" + ",\n".join(lines) + f"\n){table_comment};"
+        return self._ddl
+
+    @property
+    def aliases(self):
+        """别名索引：别名（小写） -> 字段名，包含字段名、注释中的名称以及额外登记的别名"""
+        if self._alias_index is None:
+            index = {}
+            for name, info in self.columns.items():
+                index.setdefault(name.lower(), name)
+                alias = comment_to_alias(info['comment'])
+                if alias:
+                    index.setdefault(alias.lower(), name)
+            index.update(self._aliases)
+            self._alias_index = index
+        return self._alias_index
+
+    def add_aliases(self, aliases):
+        """登记额外的别名，优先于从注释中提取的别名"""
+        for alias, column in aliases.items():
+            self._aliases[alias.lower()] = column
+        self._alias_index = None
+
+    def resolve(self, alias):
+        """将别名解析为字段名，无法解析时返回None"""
+        return self.aliases.get(alias.lower())
+
+class SchemaRegistry:
+    def __init__(self):
+        """初始化表结构注册表"""
+        self.tables = OrderedDict()
+        # 反向索引：别名（小写） -> 包含该别名的表名集合
+        self._alias_tables = {}
+        self._alias_lengths = set()
+        self._lock = threading.Lock()
+
+    def register_ddl(self, ddl, aliases=None):
+        """
+        登记一个或多个建表语句
+
+        Args:
+            ddl (str): 建表语句，可以包含多张表
+            aliases (dict, optional): 额外的别名 -> 字段名映射，只对单表语句有效
+
+        Returns:
+            list: 登记的表名列表
+        """
+        statements = [part for part in re.split(r'(?=CREATE\s+TABLE)', ddl, flags=re.IGNORECASE) if part.strip()]
+        names = []
+        for statement in statements:
+            match = _CREATE_TABLE_PATTERN.search(statement)
+            if not match:
+                continue
+            name = match.group(1)
+            comment_match = _TABLE_COMMENT_PATTERN.search(statement)
+            table = TableSchema(name, ddl=statement.strip(), comment=comment_match.group(1) if comment_match else '')
+
+            # 别名索引只做轻量扫描，完整的字段解析延迟到首次使用
+            table_aliases = [name]
+            for column, comment in _COLUMN_ALIAS_PATTERN.findall(statement):
+                table_aliases.append(column)
+                table_aliases.append(comment_to_alias(comment))
+            if table.comment:
+                table_aliases.append(comment_to_alias(table.comment))
+
+            self._add_table(table, table_aliases)
+            names.append(name)
+
+        if aliases and len(names) == 1:
+            self.add_aliases(names[0], aliases)
+        return names
+
+    def load_ddl_directory(self, directory):
+        """
+        从目录加载建表语句，每个.sql文件可以包含多张表
+
+        Args:
+            directory (str): DDL目录
+
+        Returns:
+            int: 加载的表数量
+        """
+        count = 0
+        for path in sorted(glob.glob(os.path.join(directory, "*.sql"))):
+            with open(path, encoding="utf-8") as f:
+                count += len(self.register_ddl(f.read()))
+        print(f"从 {directory} 加载了 {count} 张表的结构")
+        return count
+
+    def load_information_schema(self, path):
+        """
+        从information_schema.COLUMNS导出文件加载表结构
+
+        支持CSV或JSON（行对象列表，也可以是Java API返回的{"data": [...]}），
+        需要TABLE_NAME、COLUMN_NAME列，可选COLUMN_TYPE/DATA_TYPE、COLUMN_COMMENT、TABLE_COMMENT。
+
+        Args:
+            path (str): 导出文件路径
+
+        Returns:
+            int: 加载的表数量
+        """
+        with open(path, encoding="utf-8") as f:
+            if path.endswith(".json"):
+                rows = json.load(f)
+                if isinstance(rows, dict):
+                    rows = rows.get("data", [])
+            else:
+                rows = list(csv.DictReader(f))
+        count = self.register_information_schema_rows(rows)
+        print(f"从 {path} 加载了 {count} 张表的结构")
+        return count
+
+    def register_information_schema_rows(self, rows):
+        """
+        登记information_schema.COLUMNS查询结果
+
+        Args:
+            rows (list): 行对象列表，字段名不区分大小写
+
+        Returns:
+            int: 登记的表数量
+        """
+        tables = OrderedDict()
+        comments = {}
+        for row in rows:
+            row = {key.upper(): value for key, value in row.items()}
+            name = row["TABLE_NAME"]
+            column_type = row.get("COLUMN_TYPE") or row.get("DATA_TYPE") or "varchar(255)"
+            tables.setdefault(name, []).append((row["COLUMN_NAME"], column_type, row.get("COLUMN_COMMENT") or ''))
+            if row.get("TABLE_COMMENT"):
+                comments[name] = row["TABLE_COMMENT"]
+
+        for name, columns in tables.items():
+            table = TableSchema(name, columns=columns, comment=comments.get(name, ''))
+            table_aliases = [name] + [column for column, _, _ in columns]
+            table_aliases += [comment_to_alias(comment) for _, _, comment in columns]
+            if table.comment:
+                table_aliases.append(comment_to_alias(table.comment))
+            self._add_table(table, table_aliases)
+        return len(tables)
+
+    def add_aliases(self, table_name, aliases):
+        """
+        为表登记额外的别名
+
+        Args:
+            table_name (str): 表名
+            aliases (dict): 别名 -> 字段名
+        """
+        table = self.tables[table_name]
+        table.add_aliases(aliases)
+        with self._lock:
+            for alias in aliases:
+                self._index_alias(alias, table_name)
+
+    def _add_table(self, table, aliases):
+        with self._lock:
+            self.tables[table.name] = table
+            for alias in aliases:
+                self._index_alias(alias, table.name)
+
+    def _index_alias(self, alias, table_name):
+        alias = (alias or '').strip().lower()
+        if not alias:
+            return
+        self._alias_tables.setdefault(alias, set()).add(table_name)
+        self._alias_lengths.add(len(alias))
+
+    def get_table(self, name):
+        """获取表结构，不存在时返回None"""
+        return self.tables.get(name)
+
+    def table_names(self):
+        """所有已登记的表名"""
+        return list(self.tables.keys())
+
+    def select_tables(self, user_query, limit=3):
+        """
+        根据用户查询选择候选表
+
+        对查询的每个位置只查找已登记的别名长度，查找次数与查询长度相关、与表的数量无关。
+        出现在多张表中的通用别名（如ts_code）权重较低。
+
+        Args:
+            user_query (str): 用户的自然语言查询
+            limit (int): 最多返回的表数量
+
+        Returns:
+            list: 按匹配得分排序的表名列表，没有任何匹配时返回默认表
+        """
+        text = user_query.lower()
+        lengths = sorted(self._alias_lengths, reverse=True)
+        scores = {}
+        matched = set()
+        for start in range(len(text)):
+            for length in lengths:
+                alias = text[start:start + length]
+                if len(alias) < length or alias in matched:
+                    continue
+                tables = self._alias_tables.get(alias)
+                if not tables or not _is_word_boundary(text, start, start + length):
+                    continue
+                matched.add(alias)
+                for table_name in tables:
+                    scores[table_name] = scores.get(table_name, 0) + 1.0 / len(tables)
+
+        if not scores:
+            return [DEFAULT_TABLE] if DEFAULT_TABLE in self.tables else self.table_names()[:limit]
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0] != DEFAULT_TABLE))
+        return [name for name, _ in ranked[:limit]]
+
+    def get_schema_text(self, table_names):
+        """拼接多张表的建表语句，作为LLM的表结构上下文"""
+        return "\n\n".join(self.tables[name].ddl for name in table_names if name in self.tables)
+
+def _is_word_char(ch):
+    return ch.isascii() and (ch.isalnum() or ch == '_')
+
+def _is_word_boundary(text, start, end):
+    """英文别名需要是完整的单词，避免pe匹配到open中的一部分；中文别名不做限制"""
+    if start > 0 and _is_word_char(text[start]) and _is_word_char(text[start - 1]):
+        return False
+    if end < len(text) and _is_word_char(text[end - 1]) and _is_word_char(text[end]):
+        return False
+    return True
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+def get_schema_registry():
+    """
+    获取进程内共享的表结构注册表
+
+    内置stock_business表，另外加载SCHEMA_DDL_DIR目录（默认为项目下的schemas目录）中的建表语句，
+    以及SCHEMA_INFORMATION_SCHEMA指定的information_schema导出文件。
+    """
+    global _default_registry
+    if _default_registry is None:
+        with _default_registry_lock:
+            if _default_registry is None:
+                registry = SchemaRegistry()
+                registry.register_ddl(STOCK_BUSINESS_SCHEMA)
+
+                ddl_dir = os.environ.get(
+                    "SCHEMA_DDL_DIR",
+                    os.path.join(os.path.dirname(os.path.abspath(__file__)), "schemas")
+                )
+                if os.path.isdir(ddl_dir):
+                    registry.load_ddl_directory(ddl_dir)
+
+                information_schema = os.environ.get("SCHEMA_INFORMATION_SCHEMA")
+                if information_schema:
+                    registry.load_information_schema(information_schema)
+
+                _default_registry = registry
+    return _default_registry
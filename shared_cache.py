@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from result_cache import TTLCache
+
+class SQLiteCache:
+    def __init__(self, path, max_bytes=None, default_ttl=None, mmap_size=None):
+        """
+        初始化基于SQLite的共享缓存，同一台机器上的多个worker进程共用一个缓存文件
+
+        使用WAL模式保证读写并发，读取通过mmap完成；写入和淘汰在同一个事务中进行，保证原子性。
+
+        Args:
+            path (str): 缓存文件路径
+            max_bytes (int, optional): 缓存值的总大小上限（字节），默认读取SHARED_CACHE_MAX_BYTES
+            default_ttl (float, optional): 默认有效期（秒），默认读取SHARED_CACHE_TTL
+            mmap_size (int, optional): SQLite内存映射大小（字节），默认读取SHARED_CACHE_MMAP_SIZE
+        """
+        self.path = path
+        self.max_bytes = max_bytes or int(os.environ.get("SHARED_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+        self.default_ttl = default_ttl or float(os.environ.get("SHARED_CACHE_TTL", "28800"))
+        self.mmap_size = mmap_size or int(os.environ.get("SHARED_CACHE_MMAP_SIZE", str(256 * 1024 * 1024)))
+        # 读取时最多每隔这么久更新一次访问时间，避免每次读取都产生写操作
+        self.touch_interval = 60
+        self._local = threading.local()
+        self._hits = 0
+        self._misses = 0
+        self._init_db()
+
+    def _connect(self):
+        """每个进程的每个线程使用独立的连接，fork之后重新建立连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={self.mmap_size}")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed_at ON cache (accessed_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires_at ON cache (expires_at)")
+            # 缓存值总大小，与写入在同一事务中维护，避免每次淘汰都全表求和
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('total_size', 0)")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, key):
+        """获取缓存值，不存在或已过期时返回None"""
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute("SELECT value, expires_at, accessed_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < now:
+            self._misses += 1
+            return None
+
+        if now - row[2] > self.touch_interval:
+            try:
+                conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            except sqlite3.OperationalError:
+                # 访问时间只影响淘汰顺序，写锁繁忙时跳过
+                pass
+        self._hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        """写入缓存，总大小超过上限时在同一事务中淘汰过期和最久未访问的条目"""
+        data = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            old = conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now + (ttl or self.default_ttl), now)
+            )
+            total = self._add_size(conn, len(data) - (old[0] if old else 0))
+            if total > self.max_bytes:
+                self._evict(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def add(self, key, value, ttl=None):
+        """
+        键不存在（或已过期）时写入，多个进程同时写入同一个键时只有一个成功
+
+        Returns:
+            bool: 是否写入成功
+        """
+        data = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = conn.execute("SELECT size FROM cache WHERE key = ? AND expires_at < ?", (key, now)).fetchone()
+            if expired:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._add_size(conn, -expired[0])
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now + (ttl or self.default_ttl), now)
+            )
+            added = cursor.rowcount == 1
+            if added:
+                total = self._add_size(conn, len(data))
+                if total > self.max_bytes:
+                    self._evict(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return added
+
+    def delete(self, key):
+        """删除缓存条目"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            old = conn.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            if old:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._add_size(conn, -old[0])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _add_size(self, conn, delta):
+        conn.execute("UPDATE meta SET value = value + ? WHERE name = 'total_size'", (delta,))
+        return conn.execute("SELECT value FROM meta WHERE name = 'total_size'").fetchone()[0]
+
+    def _evict(self, conn, now):
+        """先删除过期条目，再按访问时间淘汰，直到总大小降到上限的90%"""
+        freed = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache WHERE expires_at < ?", (now,)).fetchone()[0]
+        conn.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+        total = self._add_size(conn, -freed)
+
+        target = int(self.max_bytes * 0.9)
+        while total > target:
+            rows = conn.execute("SELECT key, size FROM cache ORDER BY accessed_at LIMIT 64").fetchall()
+            if not rows:
+                break
+            freed = 0
+            for key, size in rows:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                freed += size
+                if total - freed <= target:
+                    break
+            total = self._add_size(conn, -freed)
+
+    def get_metrics(self):
+        """获取缓存指标，命中统计为当前进程的数据"""
+        conn = self._connect()
+        entries = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        total = conn.execute("SELECT value FROM meta WHERE name = 'total_size'").fetchone()[0]
+        lookups = self._hits + self._misses
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "entries": entries,
+            "total_bytes": total,
+            "max_bytes": self.max_bytes,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": round(self._hits / lookups, 3) if lookups else None
+        }
+
+class NamespacedCache:
+    """为共享缓存的键加上命名空间前缀，不同用途的缓存互不冲突"""
+
+    def __init__(self, backend, namespace, ttl=None):
+        self.backend = backend
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def _key(self, key):
+        return f"{self.namespace}:{key}"
+
+    def get(self, key):
+        return self.backend.get(self._key(key))
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(self._key(key), value, ttl or self.ttl)
+
+    def add(self, key, value, ttl=None):
+        return self.backend.add(self._key(key), value, ttl or self.ttl)
+
+    def delete(self, key):
+        self.backend.delete(self._key(key))
+
+    def get_metrics(self):
+        return self.backend.get_metrics()
+
+def make_cache_key(*parts):
+    """将多个部分拼接并取哈希，作为定长的缓存键"""
+    return hashlib.sha1("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+_sqlite_cache = None
+_sqlite_cache_lock = threading.Lock()
+
+def get_cache(namespace, ttl=None, max_entries=None):
+    """
+    获取指定用途的缓存，后端由CACHE_BACKEND环境变量决定，调用方无需修改代码即可切换
+
+    - memory（默认）：进程内缓存，每个worker各自一份
+    - sqlite：SHARED_CACHE_PATH指定的共享缓存文件，多个worker进程共用，重启后仍然有效
+    - none：不使用缓存
+
+    Args:
+        namespace (str): 缓存用途，如sql、embedding、result
+        ttl (float, optional): 该用途的默认有效期（秒）
+        max_entries (int, optional): memory后端的最大条目数，默认读取CACHE_MAX_ENTRIES；sqlite后端按总大小淘汰，不使用该参数
+
+    Returns:
+        缓存对象（提供get/set/delete），CACHE_BACKEND为none时返回None
+    """
+    global _sqlite_cache
+    backend = os.environ.get("CACHE_BACKEND", "memory").lower()
+    if backend == "none":
+        return None
+    if backend == "sqlite":
+        if _sqlite_cache is None:
+            with _sqlite_cache_lock:
+                if _sqlite_cache is None:
+                    _sqlite_cache = SQLiteCache(os.environ.get("SHARED_CACHE_PATH", "text2sql_cache.sqlite3"))
+        return NamespacedCache(_sqlite_cache, namespace, ttl)
+    return TTLCache(
+        max_entries=max_entries or int(os.environ.get("CACHE_MAX_ENTRIES", "1000")),
+        ttl=ttl or float(os.environ.get("SHARED_CACHE_TTL", "28800"))
+    )
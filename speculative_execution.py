@@ -0,0 +1,170 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sql_canonical import canonicalize_sql
+
+class Speculation:
+    """一次预执行：候选SQL及其执行结果"""
+
+    def __init__(self, sql, source):
+        self.sql = sql
+        self.source = source
+        self.canonical_sql = canonicalize_sql(sql)
+        self.future = None
+        self.started_at = time.time()
+        self.finished_at = None
+
+class SpeculativeExecutor:
+    def __init__(self, execute_fn, enabled=None, max_in_flight=None, max_per_minute=None):
+        """
+        初始化预执行器，在LLM生成SQL期间预先执行候选SQL
+
+        Args:
+            execute_fn (callable): 执行SQL的函数，参数为SQL语句，返回执行结果
+            enabled (bool, optional): 是否启用预执行，默认读取SPECULATION_ENABLED
+            max_in_flight (int, optional): 同时进行的预执行上限，默认读取SPECULATION_MAX_IN_FLIGHT
+            max_per_minute (int, optional): 每分钟发往Java API的预执行上限，默认读取SPECULATION_MAX_PER_MINUTE
+        """
+        if enabled is None:
+            enabled = os.environ.get("SPECULATION_ENABLED", "True").lower() == "true"
+        self.enabled = enabled
+        self.execute_fn = execute_fn
+        self.max_in_flight = max_in_flight or int(os.environ.get("SPECULATION_MAX_IN_FLIGHT", "4"))
+        self.max_per_minute = max_per_minute or int(os.environ.get("SPECULATION_MAX_PER_MINUTE", "60"))
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="speculative")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        # 令牌桶，限制预执行给Java API带来的额外负载
+        self._tokens = float(self.max_per_minute)
+        self._tokens_updated_at = time.time()
+
+        # 指标
+        self._submitted = 0
+        self._skipped = 0
+        self._hits = 0
+        self._misses = 0
+        self._abandoned = 0
+        self._latency_saved = 0.0
+
+    def submit(self, candidate):
+        """
+        提交候选SQL进行预执行
+
+        Args:
+            candidate (tuple): (候选SQL, 来源)，为None时不执行
+
+        Returns:
+            Speculation: 预执行对象，未启用、无候选或超出预算时返回None
+        """
+        if not self.enabled or not candidate:
+            return None
+
+        sql, source = candidate
+        with self._lock:
+            if self._in_flight >= self.max_in_flight or not self._take_token():
+                self._skipped += 1
+                return None
+            self._in_flight += 1
+            self._submitted += 1
+
+        speculation = Speculation(sql, source)
+        speculation.future = self._executor.submit(self._run, speculation)
+        print(f"预执行候选SQL（来源: {source}）: {sql}")
+        return speculation
+
+    def _take_token(self):
+        now = time.time()
+        self._tokens = min(self.max_per_minute, self._tokens + (now - self._tokens_updated_at) * self.max_per_minute / 60)
+        self._tokens_updated_at = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def _run(self, speculation):
+        try:
+            return self.execute_fn(speculation.sql)
+        finally:
+            speculation.finished_at = time.time()
+            with self._lock:
+                self._in_flight -= 1
+
+    def resolve(self, speculation, final_sql):
+        """
+        用最终SQL核对预执行结果
+
+        Args:
+            speculation (Speculation): 预执行对象，可以为None
+            final_sql (str): SQLGenerator生成的最终SQL
+
+        Returns:
+            dict: 规范化后SQL一致时返回预执行的结果，否则返回None（结果被丢弃）
+        """
+        if speculation is None:
+            return None
+
+        final_ready_at = time.time()
+        if speculation.canonical_sql != canonicalize_sql(final_sql):
+            # 尚未开始的预执行直接取消，已在执行的让其完成后丢弃
+            cancelled = speculation.future.cancel()
+            with self._lock:
+                self._misses += 1
+                if cancelled:
+                    self._in_flight -= 1
+            return None
+
+        try:
+            result = speculation.future.result()
+        except Exception as e:
+            print(f"预执行出错，改为正常执行: {e}")
+            with self._lock:
+                self._misses += 1
+            return None
+
+        # 节省的时间 = 执行耗时 - 最终SQL生成后仍需等待的时间
+        execution_time = speculation.finished_at - speculation.started_at
+        saved = execution_time - max(0.0, speculation.finished_at - final_ready_at)
+        with self._lock:
+            self._hits += 1
+            self._latency_saved += saved
+        print(f"预执行命中，节省 {saved:.2f}s")
+        return result
+
+    def abandon(self, speculation):
+        """
+        SQL生成失败（如准入控制拒绝）时放弃预执行：尚未开始的直接取消，已在执行的让其完成后丢弃
+
+        Args:
+            speculation (Speculation): 预执行对象，可以为None
+        """
+        if speculation is None:
+            return
+        cancelled = speculation.future.cancel()
+        with self._lock:
+            self._abandoned += 1
+            if cancelled:
+                self._in_flight -= 1
+
+    def get_metrics(self):
+        """
+        获取预执行指标
+
+        Returns:
+            dict: 预执行次数、命中率、节省的耗时等
+        """
+        with self._lock:
+            resolved = self._hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "in_flight": self._in_flight,
+                "submitted": self._submitted,
+                "skipped_budget": self._skipped,
+                "hits": self._hits,
+                "misses": self._misses,
+                "abandoned": self._abandoned,
+                "hit_rate": round(self._hits / resolved, 3) if resolved else None,
+                "latency_saved_total": round(self._latency_saved, 3),
+                "latency_saved_avg": round(self._latency_saved / self._hits, 3) if self._hits else None
+            }
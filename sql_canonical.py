@@ -0,0 +1,64 @@
+import re
+
+# 字符串字面量（MySQL中单引号和双引号都表示字符串）与其他部分分开处理，字面量保持原样
+_LITERAL_PATTERN = re.compile(r"""('(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")""")
+_OPERATOR_PATTERN = re.compile(r'\s*(<=|>=|<>|!=|=|<|>)\s*')
+_SIMPLE_QUERY_PATTERN = re.compile(
+    r'^select (?P<select>.+?) from (?P<table>[\w.]+)'
+    r'(?: where (?P<where>.+?))?'
+    r'(?P<tail>(?: order by .+?)?(?: limit .+)?)$'
+)
+
+def canonicalize_sql(sql):
+    """
+    将SQL转换为规范形式，用于判断两条SQL是否等价
+
+    规范化内容：去除首尾空白和末尾分号、去除反引号、字面量以外统一小写、
+    合并空白、统一运算符两侧空格；对于不含子查询、JOIN和OR的简单查询，
+    SELECT字段和顶层AND条件按字母序排列。
+
+    Args:
+        sql (str): SQL语句
+
+    Returns:
+        str: 规范化后的SQL，输入为空时返回空字符串
+    """
+    if not sql:
+        return ''
+
+    parts = _LITERAL_PATTERN.split(sql.strip().rstrip(';').strip())
+    normalized = []
+    for i, part in enumerate(parts):
+        if i % 2 == 1:
+            # 字符串字面量保持原样
+            normalized.append(part)
+            continue
+        part = part.replace('`', '').lower()
+        part = _OPERATOR_PATTERN.sub(r' \1 ', part)
+        part = re.sub(r'\s*,\s*', ', ', part)
+        part = re.sub(r'\(\s+', '(', part)
+        part = re.sub(r'\s+\)', ')', part)
+        part = re.sub(r'\s+', ' ', part)
+        normalized.append(part)
+    sql = ''.join(normalized).strip()
+
+    if "'" in sql or '"' in sql or '(' in sql:
+        return sql
+
+    match = _SIMPLE_QUERY_PATTERN.match(sql)
+    if not match or ' join ' in sql or ' group by ' in sql or ' union ' in sql:
+        return sql
+
+    select_fields = sorted(field.strip() for field in match.group('select').split(','))
+    result = 'select ' + ', '.join(select_fields) + ' from ' + match.group('table')
+
+    where = match.group('where')
+    if where:
+        # OR和BETWEEN ... AND会改变AND的切分语义，此时不调整条件顺序
+        if ' or ' in f' {where} ' or ' between ' in f' {where} ':
+            result += ' where ' + where
+        else:
+            conditions = sorted(condition.strip() for condition in re.split(r'\band\b', where))
+            result += ' where ' + ' and '.join(conditions)
+
+    return result + (match.group('tail') or '')
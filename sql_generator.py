@@ -1,5 +1,11 @@
 from llm_client import LLMClient, LLMProvider
 from schema_knowledge import STOCK_BUSINESS_SCHEMA
+from schema_registry import DEFAULT_TABLE, get_schema_registry
+from admission_control import AdmissionRejected
+from shared_cache import get_cache, make_cache_key
+from indicator_engine import COMPARISON_PRIMITIVES, parse_indicator_query, use_numpy
+from query_router import ModelRouter
+import os
 import re
 try:
     from qa_knowledge import QA_DATA, get_example_queries, get_example_sql, get_indicator_explanation
@@ -8,23 +14,109 @@ except ImportError:
     use_qa_knowledge = False
     print("QA知识库未找到，将使用纯LLM生成SQL")
 
+# 规则解析支持的比较词 -> SQL运算符
+RULE_OPERATORS = {
+    '大于等于': '>=', '小于等于': '<=', '不低于': '>=', '不少于': '>=', '不高于': '<=', '不超过': '<=',
+    '大于': '>', '高于': '>', '超过': '>', '多于': '>',
+    '小于': '<', '低于': '<', '少于': '<',
+    '等于': '=', '>=': '>=', '<=': '<=', '>': '>', '<': '<', '=': '='
+}
+# 规则解析时允许出现的连接词和修饰词
+RULE_FILLER_PATTERN = re.compile(r'查询|找出|筛选|选出|列出|显示|所有|全部|的|股票|个股|并且|而且|同时|以及|且|和|与|\band\b|[，,、。;；\s]', re.IGNORECASE)
+
+# 预编译的正则表达式，避免首个查询时再编译
+SELECT_PATTERN = re.compile(r'SELECT\s+(.*?)\s+FROM', re.IGNORECASE | re.DOTALL)
+WHERE_PATTERN = re.compile(r'WHERE\s+(.*?)($|;|\s+ORDER BY|\s+GROUP BY|\s+HAVING|\s+LIMIT)', re.IGNORECASE | re.DOTALL)
+
+# SQL校验：只允许单条查询语句
+READ_ONLY_SQL_PATTERN = re.compile(r'^\s*(select|with)\b[^;]*;?\s*$', re.IGNORECASE | re.DOTALL)
+TABLE_REFERENCE_PATTERN = re.compile(r'\b(?:from|join)\s+`?(\w+)`?', re.IGNORECASE)
+# WITH子句定义的公用表表达式名称，如 WITH t AS (...), u (a, b) AS (...)
+CTE_NAME_PATTERN = re.compile(r'(?:\bwith(?:\s+recursive)?|,)\s*`?(\w+)`?\s*(?:\([^()]*\))?\s*\bas\s*\(', re.IGNORECASE)
+# 读取以外的副作用：写文件、加锁
+UNSAFE_SQL_PATTERN = re.compile(r'\binto\b|\bfor\s+update\b|\block\s+in\s+share\s+mode\b', re.IGNORECASE)
+STRING_LITERAL_PATTERN = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+# 条件中的字段名，不包括函数名、表别名前缀和数字
+IDENTIFIER_PATTERN = re.compile(r'(?<![\w.`])`?([A-Za-z_]\w*)(?!\w)`?(?!\s*[(.])')
+ALIAS_PATTERN = re.compile(r'\bas\s+`?(\w+)`?', re.IGNORECASE)
+SQL_KEYWORDS = {
+    'select', 'from', 'where', 'and', 'or', 'not', 'in', 'is', 'null', 'like', 'between', 'exists',
+    'as', 'case', 'when', 'then', 'else', 'end', 'true', 'false', 'asc', 'desc', 'limit', 'offset',
+    'order', 'group', 'by', 'having', 'distinct', 'all', 'any', 'interval', 'day', 'date', 'with',
+    'join', 'inner', 'left', 'right', 'outer', 'on', 'union', 'regexp', 'div', 'mod', 'xor'
+}
+
 class SQLGenerator:
-    def __init__(self, llm_client=None):
+    def __init__(self, llm_client=None, schema_registry=None, cache=None, small_llm_client=None):
         """
         初始化SQL生成器
         
         Args:
             llm_client (LLMClient, optional): LLM客户端实例
+            schema_registry (SchemaRegistry, optional): 表结构注册表，默认使用进程内共享的注册表
+            cache (optional): LLM生成SQL的缓存，默认按CACHE_BACKEND环境变量创建
+            small_llm_client (LLMClient, optional): 简单查询使用的小模型客户端，默认在启用模型路由时按SMALL_LLM_MODEL创建
         """
         # 直接使用Ollama而非OpenRouter，避免编码问题
         self.llm_client = llm_client or LLMClient(provider=LLMProvider.OLLAMA, 
-                                                 base_url="http://localhost:11434",
+                                                 base_url=os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434"),
                                                  model="qwen2.5-coder:latest")
+        # 按查询复杂度选择模型：简单查询使用小模型，复杂查询和小模型校验失败的查询使用大模型
+        if small_llm_client is None and llm_client is None and os.environ.get("MODEL_ROUTING_ENABLED", "False").lower() == "true":
+            small_llm_client = LLMClient(provider=LLMProvider.OLLAMA,
+                                         base_url=os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434"),
+                                         model=os.environ.get("SMALL_LLM_MODEL", "qwen2.5-coder:1.5b"))
+        self.router = ModelRouter(self.llm_client, small_llm_client)
         self.schema = STOCK_BUSINESS_SCHEMA
         # 初始化字段映射表
         self._init_field_mapping()
+        # 表结构注册表，stock_business的字段映射作为其别名登记
+        self.schema_registry = schema_registry or get_schema_registry()
+        self.schema_registry.add_aliases(DEFAULT_TABLE, self.field_mapping)
+        # 每个查询最多放入提示词的表数量
+        self.max_prompt_tables = int(os.environ.get("SCHEMA_MAX_PROMPT_TABLES", "3"))
+        # 用户查询 -> LLM生成的SQL
+        self.cache = cache if cache is not None else get_cache("sql", ttl=float(os.environ.get("SQL_CACHE_TTL", "86400")))
+        # WHERE条件字段和规则解析的匹配正则，由build_indexes()构建
+        self._condition_field_pattern = None
+        self._rule_condition_pattern = None
+        self._field_alias_pattern = None
+        self._field_lookup = {}
         # QA知识库匹配阈值
         self.qa_match_threshold = 0.7
+        # 低于匹配阈值的QA示例作为预执行候选的最低得分
+        self.speculation_min_score = float(os.environ.get("SPECULATION_MIN_SCORE", "0.4"))
+    
+    def build_indexes(self):
+        """
+        构建字段匹配所需的索引和正则表达式
+        
+        首次调用_enhance_sql时会自动构建，也可以在启动预热阶段提前调用。
+        """
+        # 所有数据库字段合并为一个正则，一次扫描即可找出WHERE条件中涉及的字段
+        db_fields = sorted(set(self.field_mapping.values()), key=len, reverse=True)
+        self._condition_field_pattern = re.compile(
+            r'\b(' + '|'.join(re.escape(field) for field in db_fields) + r')\b',
+            re.IGNORECASE
+        )
+        
+        # 提前解析默认表的字段信息
+        self.schema_registry.get_table(DEFAULT_TABLE).aliases
+        
+        # 规则解析："字段 比较词 数值[单位]"，字段别名按长度倒序，优先匹配更长的别名
+        self._field_lookup = {alias.lower(): field for alias, field in self.field_mapping.items()}
+        aliases = sorted(self.field_mapping.keys(), key=len, reverse=True)
+        self._field_alias_pattern = re.compile(
+            r'(?<![A-Za-z0-9_])(' + '|'.join(re.escape(alias) for alias in aliases) + r')(?![A-Za-z0-9_])',
+            re.IGNORECASE
+        )
+        operators = sorted(RULE_OPERATORS.keys(), key=len, reverse=True)
+        self._rule_condition_pattern = re.compile(
+            r'(?<![A-Za-z0-9_])(?P<field>' + '|'.join(re.escape(alias) for alias in aliases) + r')'
+            r'\s*(?P<op>' + '|'.join(re.escape(op) for op in operators) + r')'
+            r'\s*(?P<value>-?\d+(?:\.\d+)?)\s*(?:%|倍|元)?',
+            re.IGNORECASE
+        )
     
     def _init_field_mapping(self):
         """初始化字段名映射表"""
@@ -250,24 +342,178 @@ class SQLGenerator:
                     print(f"从QA知识库匹配到SQL: {qa_sql}")
                     return qa_sql
             
-            # 如果知识库没有匹配，使用LLM生成
-            sql = self.llm_client.generate_sql(user_query, self.schema)
+            # 相同查询之前由LLM生成过的SQL直接复用
+            cache_key = self._sql_cache_key(user_query)
+            if cache_key:
+                cached_sql = self.cache.get(cache_key)
+                if cached_sql:
+                    return cached_sql
+            
+            # 如果知识库没有匹配，使用LLM生成，提示词中只放入与查询相关的表结构
+            sql = self.router.generate_sql(
+                user_query,
+                self.get_schema_for_query(user_query),
+                fields=self.referenced_fields(user_query),
+                validate=lambda generated: self.validate_sql(self._rewrite_sql(generated))
+            )
             
             # 简单检查确保返回的是SQL语句
             if sql and ("select" in sql.lower() or "SELECT" in sql):
-                # 转换字段名
-                sql = self._convert_field_names(sql)
-                # 增强SQL查询，确保包含查询条件中涉及的字段
-                sql = self._enhance_sql(sql)
+                # 按引用的表转换字段名，查询stock_business时补充条件中涉及的字段
+                sql = self._rewrite_sql(sql)
+                # 只缓存通过校验的SQL，执行失败时由调用方通过forget_sql删除
+                if cache_key and self.validate_sql(sql):
+                    self.cache.set(cache_key, sql)
                 return sql
             else:
                 # 如果不是有效的SQL，返回一个默认查询
                 print("生成的SQL无效，返回默认查询")
                 return "SELECT ts_code, stock_name, pe, ma5 FROM stock_business LIMIT 5"
+        except AdmissionRejected:
+            # 准入控制拒绝的请求需要返回给调用方，不能退化为默认查询
+            raise
         except Exception as e:
             print(f"SQL生成过程中出错: {e}")
             return "SELECT ts_code, stock_name, pe, ma5 FROM stock_business LIMIT 5"
     
+    def _sql_cache_key(self, user_query):
+        """LLM生成SQL的缓存键，包含可能生成该SQL的所有模型，更换模型后不会复用旧结果"""
+        if self.cache is None:
+            return None
+        return make_cache_key(*self.router.models(), user_query.strip())
+    
+    def forget_sql(self, user_query):
+        """
+        删除缓存中该查询由LLM生成的SQL，SQL执行失败时调用，下次查询重新生成
+        
+        Args:
+            user_query (str): 用户的自然语言查询
+        """
+        cache_key = self._sql_cache_key(user_query)
+        if cache_key:
+            self.cache.delete(cache_key)
+    
+    def preload_models(self):
+        """预加载LLM模型，启用模型路由时同时预加载大小两个模型"""
+        return self.router.preload()
+    
+    def referenced_fields(self, user_query):
+        """
+        找出查询中提到的数据库字段
+        
+        Args:
+            user_query (str): 用户的自然语言查询
+            
+        Returns:
+            list: 字段名列表，按出现顺序去重
+        """
+        if self._field_alias_pattern is None:
+            self.build_indexes()
+        fields = []
+        for alias in self._field_alias_pattern.findall(user_query):
+            field = self._field_lookup[alias.lower()]
+            if field not in fields:
+                fields.append(field)
+        return fields
+    
+    def validate_sql(self, sql):
+        """
+        校验生成的SQL：单条查询语句、不含INTO和加锁子句、括号配对、引用的表已登记（WITH定义的名称除外），单表查询时条件中的字段都存在
+        
+        Args:
+            sql (str): SQL语句（已转换字段名）
+            
+        Returns:
+            bool: 是否有效
+        """
+        if not sql or not READ_ONLY_SQL_PATTERN.match(sql):
+            return False
+        
+        # 去掉字符串常量后再检查括号和字段，未闭合的引号视为无效
+        stripped = STRING_LITERAL_PATTERN.sub("''", sql)
+        if "'" in stripped.replace("''", "") or '"' in stripped:
+            return False
+        if UNSAFE_SQL_PATTERN.search(stripped):
+            return False
+        depth = 0
+        for char in stripped:
+            depth += {'(': 1, ')': -1}.get(char, 0)
+            if depth < 0:
+                return False
+        if depth != 0:
+            return False
+        
+        tables = self.referenced_tables(stripped)
+        if not tables or any(self.schema_registry.get_table(table) is None for table in tables):
+            return False
+        
+        # 多表、子查询等情况下字段归属不易判断，只检查单表查询
+        if len(tables) != 1 or stripped.lower().count('select') != 1:
+            return True
+        columns = set(column.lower() for column in self.schema_registry.get_table(tables.pop()).columns)
+        aliases = set(alias.lower() for alias in ALIAS_PATTERN.findall(stripped))
+        for match in WHERE_PATTERN.finditer(stripped):
+            for identifier in IDENTIFIER_PATTERN.findall(match.group(1)):
+                identifier = identifier.lower()
+                if identifier not in columns and identifier not in aliases and identifier not in SQL_KEYWORDS:
+                    return False
+        return True
+    
+    def referenced_tables(self, sql):
+        """
+        SQL中FROM/JOIN引用的表名，不包括WITH子句定义的名称
+        
+        Args:
+            sql (str): SQL语句
+            
+        Returns:
+            set: 表名集合
+        """
+        stripped = STRING_LITERAL_PATTERN.sub("''", sql)
+        ctes = set(name.lower() for name in CTE_NAME_PATTERN.findall(stripped)) if stripped.lstrip()[:4].lower() == 'with' else set()
+        return set(table for table in TABLE_REFERENCE_PATTERN.findall(stripped) if table.lower() not in ctes)
+    
+    def _rewrite_sql(self, sql):
+        """
+        按SQL引用的表转换字段名
+        
+        只查询stock_business时使用字段映射转换并补充条件中涉及的字段；
+        查询其他登记的表时按这些表自己的别名转换，表中真实存在的字段名不做替换；引用了未登记的表时不做修改。
+        
+        Args:
+            sql (str): LLM生成的SQL语句
+            
+        Returns:
+            str: 转换后的SQL语句
+        """
+        tables = self.referenced_tables(sql)
+        if not tables or set(table.lower() for table in tables) == {DEFAULT_TABLE}:
+            return self._enhance_sql(self._convert_field_names(sql))
+        
+        schemas = [self.schema_registry.get_table(table) for table in tables]
+        if any(schema is None for schema in schemas):
+            return sql
+        columns = set(column.lower() for schema in schemas for column in schema.columns)
+        mapping = {
+            alias: column
+            for schema in schemas for alias, column in schema.aliases.items()
+            if alias not in columns
+        }
+        return self._convert_field_names(sql, mapping)
+    
+    def get_schema_for_query(self, user_query):
+        """
+        选择与查询相关的表，返回它们的建表语句
+        
+        Args:
+            user_query (str): 用户的自然语言查询
+            
+        Returns:
+            str: 候选表的建表语句
+        """
+        tables = self.schema_registry.select_tables(user_query, limit=self.max_prompt_tables)
+        return self.schema_registry.get_schema_text(tables)
+    
     def _match_from_qa_knowledge(self, user_query):
         """
         从QA知识库中匹配最相似的查询
@@ -278,8 +524,26 @@ class SQLGenerator:
         Returns:
             str: 匹配到的SQL语句，如果没有匹配则返回None
         """
+        best_match_idx, best_match_score = self._best_qa_match(user_query)
+        
+        # 如果找到超过阈值的匹配，返回对应的SQL
+        if best_match_idx >= 0 and best_match_score > self.qa_match_threshold:
+            return get_example_sql(best_match_idx)
+        
+        return None
+    
+    def _best_qa_match(self, user_query):
+        """
+        计算QA知识库中与用户查询最相似的示例
+        
+        Args:
+            user_query (str): 用户的自然语言查询
+            
+        Returns:
+            tuple: (示例索引, 相似度得分)，没有任何相似示例时索引为-1
+        """
         if not use_qa_knowledge:
-            return None
+            return -1, 0
             
         # 获取所有示例查询
         example_queries = get_example_queries()
@@ -299,22 +563,117 @@ class SQLGenerator:
             # 计算简单相似度（包含关系）
             if example in user_query or user_query in example:
                 score = len(example) / max(len(user_query), len(example))
-                if score > best_match_score and score > self.qa_match_threshold:
+                if score > best_match_score:
                     best_match_score = score
                     best_match_idx = idx
         
-        # 如果找到匹配，返回对应的SQL
-        if best_match_idx >= 0:
-            return get_example_sql(best_match_idx)
+        return best_match_idx, best_match_score
+    
+    def speculative_candidate(self, user_query):
+        """
+        获取可以在LLM生成期间预先执行的候选SQL
+        
+        候选来源依次为：低于匹配阈值的QA知识库示例、基于规则解析的简单条件查询。
+        QA知识库直接命中或SQL缓存中已有结果时不需要调用LLM，也就不需要预执行。
+        
+        Args:
+            user_query (str): 用户的自然语言查询
+            
+        Returns:
+            tuple: (候选SQL, 来源)，没有候选时返回None
+        """
+        user_query = user_query.strip()
+        best_match_idx, best_match_score = self._best_qa_match(user_query)
+        if best_match_idx >= 0 and best_match_score > self.qa_match_threshold:
+            return None
+        cache_key = self._sql_cache_key(user_query)
+        if cache_key and self.cache.get(cache_key):
+            return None
+        
+        rule_sql = self._rule_based_sql(user_query)
+        if rule_sql:
+            return rule_sql, 'rule'
+        
+        if best_match_idx >= 0 and best_match_score >= self.speculation_min_score:
+            return get_example_sql(best_match_idx), 'qa'
         
         return None
     
-    def _convert_field_names(self, sql):
+    def indicator_expression(self, user_query):
+        """
+        将包含跨交易日条件的查询解析为指标引擎的表达式
+        
+        例如"连续3天放量且市盈率小于30"中，"连续3天放量"由指标引擎识别，
+        其余"字段 比较词 数值"形式的条件作为最新交易日的比较条件一起计算。
+        没有跨交易日条件、或者存在无法识别的内容时返回None，交给SQL生成处理。
+        
+        Args:
+            user_query (str): 用户的自然语言查询
+            
+        Returns:
+            list: 条件表达式，格式见indicator_engine.describe_primitives()
+        """
+        if not use_numpy:
+            return None
+        expressions, remainder = parse_indicator_query(user_query.strip())
+        if not expressions:
+            return None
+        
+        if self._rule_condition_pattern is None:
+            self.build_indexes()
+        for match in self._rule_condition_pattern.finditer(remainder):
+            field = self._field_lookup[match.group('field').lower()]
+            operator = COMPARISON_PRIMITIVES[RULE_OPERATORS[match.group('op')]]
+            expressions.append([operator, field, float(match.group('value'))])
+        remainder = self._rule_condition_pattern.sub('', remainder)
+        if RULE_FILLER_PATTERN.sub('', remainder):
+            return None
+        
+        return expressions[0] if len(expressions) == 1 else ['and'] + expressions
+    
+    def _rule_based_sql(self, user_query):
+        """
+        将"字段 比较词 数值"形式的简单条件查询直接解析为SQL
+        
+        例如"市盈率小于30倍，换手率大于10%" -> pe < 30 AND turnover_rate > 10。
+        查询中存在无法识别的内容时返回None。
+        
+        Args:
+            user_query (str): 用户的自然语言查询
+            
+        Returns:
+            str: 解析得到的SQL语句，无法解析时返回None
+        """
+        if self._rule_condition_pattern is None:
+            self.build_indexes()
+        
+        fields = []
+        conditions = []
+        for match in self._rule_condition_pattern.finditer(user_query):
+            field = self._field_lookup[match.group('field').lower()]
+            operator = RULE_OPERATORS[match.group('op')]
+            conditions.append(f"{field} {operator} {match.group('value')}")
+            if field not in fields:
+                fields.append(field)
+        
+        if not conditions:
+            return None
+        
+        # 去掉已识别的条件和常见的连接词后不能有剩余内容，否则交给LLM处理
+        remainder = self._rule_condition_pattern.sub('', user_query)
+        if RULE_FILLER_PATTERN.sub('', remainder):
+            return None
+        
+        select_fields = ['ts_code', 'stock_name'] + [f for f in fields if f not in ('ts_code', 'stock_name')]
+        return f"SELECT {', '.join(select_fields)} FROM stock_business WHERE {' AND '.join(conditions)}"
+    
+    def _convert_field_names(self, sql, mapping=None):
         """
         转换SQL中的字段名为实际数据库字段名
         
         Args:
             sql (str): 原始SQL语句
+            mapping (dict, optional): 别名 -> 字段名，默认使用stock_business的字段映射
             
         Returns:
             str: 转换后的SQL语句
@@ -326,7 +685,7 @@ class SQLGenerator:
         replacements = []
         
         # 查找需要替换的字段
-        for user_field, db_field in self.field_mapping.items():
+        for user_field, db_field in (mapping if mapping is not None else self.field_mapping).items():
             # 跳过已经是数据库字段名的情况
             if user_field == db_field:
                 continue
@@ -385,8 +744,7 @@ class SQLGenerator:
             return sql
             
         # 提取SELECT和FROM之间的字段列表
-        select_pattern = re.compile(r'SELECT\s+(.*?)\s+FROM', re.IGNORECASE | re.DOTALL)
-        select_match = select_pattern.search(sql)
+        select_match = SELECT_PATTERN.search(sql)
         
         if not select_match:
             return sql
@@ -395,21 +753,19 @@ class SQLGenerator:
         select_fields = [field.strip() for field in select_fields]
         
         # 提取WHERE条件中的字段
-        where_pattern = re.compile(r'WHERE\s+(.*?)($|;|\s+ORDER BY|\s+GROUP BY|\s+HAVING|\s+LIMIT)', re.IGNORECASE | re.DOTALL)
-        where_match = where_pattern.search(sql)
+        where_match = WHERE_PATTERN.search(sql)
         
         if not where_match:
             return sql
             
         where_clause = where_match.group(1)
         
-        # 识别WHERE条件中涉及的字段
-        condition_fields = set()
-        for field_name in self.field_mapping.values():  # 使用实际的数据库字段名
-            # 需要检查字段名是否出现在WHERE条件中
-            pattern = r'\b' + field_name + r'\b'
-            if re.search(pattern, where_clause, re.IGNORECASE):
-                condition_fields.add(field_name)
+        # 识别WHERE条件中涉及的字段（使用实际的数据库字段名）
+        if self._condition_field_pattern is None:
+            self.build_indexes()
+        condition_fields = set(
+            match.lower() for match in self._condition_field_pattern.findall(where_clause)
+        )
         
         # 检查是否已经包含了所有条件字段
         fields_to_add = []
@@ -417,9 +773,9 @@ class SQLGenerator:
             if not any(field == f.lower() or field == f or f.endswith('.' + field) or f.lower().endswith(' as ' + field) for f in select_fields):
                 fields_to_add.append(field)
         
-        # 如果有需要添加的字段，修改SQL
+        # 如果有需要添加的字段，只修改最外层SELECT的字段列表，保留FROM
         if fields_to_add:
-            new_select = 'SELECT ' + select_match.group(1) + ', ' + ', '.join(fields_to_add)
-            sql = select_pattern.sub(new_select, sql)
+            new_fields = select_match.group(1) + ', ' + ', '.join(sorted(fields_to_add))
+            sql = sql[:select_match.start(1)] + new_fields + sql[select_match.end(1):]
         
         return sql 
\ No newline at end of file
@@ -0,0 +1,141 @@
+import os
+import time
+import threading
+
+# 进程启动时间，用于计算就绪耗时和首个快速响应耗时
+PROCESS_START_TIME = time.time()
+
+class WarmupManager:
+    def __init__(self, enabled=None, fast_response_threshold=None):
+        """
+        初始化启动预热管理器
+
+        Args:
+            enabled (bool, optional): 是否执行预热，默认读取WARMUP_ENABLED环境变量
+            fast_response_threshold (float, optional): 快速响应的耗时阈值（秒），默认读取FAST_RESPONSE_SECONDS环境变量
+        """
+        if enabled is None:
+            enabled = os.environ.get("WARMUP_ENABLED", "True").lower() == "true"
+        if fast_response_threshold is None:
+            fast_response_threshold = float(os.environ.get("FAST_RESPONSE_SECONDS", "2"))
+
+        self.enabled = enabled
+        self.fast_response_threshold = fast_response_threshold
+        # 必需步骤失败后的重试间隔（秒）
+        self.retry_interval = float(os.environ.get("WARMUP_RETRY_INTERVAL", "10"))
+        # 预热步骤列表：(步骤名称, 执行函数, 是否必需)
+        self.steps = []
+        self.step_results = []
+        self.ready_at = None
+        self.first_fast_response_at = None
+        self._ready = threading.Event()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def add_step(self, name, func, required=False):
+        """
+        添加预热步骤，步骤按添加顺序执行
+
+        Args:
+            name (str): 步骤名称
+            func (callable): 无参数的执行函数，返回False表示该步骤失败
+            required (bool): 是否必需，必需步骤失败时每隔WARMUP_RETRY_INTERVAL秒重试，成功前不会就绪
+        """
+        self.steps.append((name, func, required))
+
+    def start(self):
+        """在后台线程中执行预热，重复调用只会执行一次"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        if not self.enabled:
+            print("启动预热已关闭，组件将在首次请求时加载")
+            self._mark_ready()
+            return
+
+        thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+        thread.start()
+
+    def run(self):
+        """依次执行所有预热步骤，非必需步骤失败不影响后续步骤，必需步骤重试到成功为止"""
+        print("开始启动预热...")
+        for name, func, required in self.steps:
+            result = {"name": name, "ok": False, "duration": 0, "error": None, "attempts": 0}
+            self.step_results.append(result)
+            while True:
+                step_start = time.time()
+                error = None
+                try:
+                    ok = func() is not False
+                except Exception as e:
+                    ok = False
+                    error = str(e)
+                    print(f"预热步骤 {name} 出错: {e}")
+
+                duration = time.time() - step_start
+                result.update(ok=ok, duration=round(result["duration"] + duration, 3), error=error,
+                              attempts=result["attempts"] + 1)
+                print(f"预热步骤 {name} 完成，耗时 {duration:.2f}s，{'成功' if ok else '失败'}")
+                if ok or not required:
+                    break
+                # 必需步骤失败时（如Ollama未启动）保持未就绪，避免负载均衡把流量转发到冷实例
+                print(f"必需的预热步骤 {name} 失败，{self.retry_interval:.0f}s后重试")
+                time.sleep(self.retry_interval)
+
+        self._mark_ready()
+        print(f"启动预热完成，进程启动后 {self.ready_at - PROCESS_START_TIME:.2f}s 就绪")
+
+    def _mark_ready(self):
+        self.ready_at = time.time()
+        self._ready.set()
+
+    def is_ready(self):
+        """预热是否已完成"""
+        return self._ready.is_set()
+
+    def record_response(self, latency):
+        """
+        记录一次请求的响应耗时，用于统计首个快速响应的时间
+
+        Args:
+            latency (float): 响应耗时（秒）
+        """
+        if self.first_fast_response_at is not None or latency > self.fast_response_threshold:
+            return
+        with self._lock:
+            if self.first_fast_response_at is None:
+                self.first_fast_response_at = time.time()
+                print(f"首个快速响应出现在进程启动后 {self.first_fast_response_at - PROCESS_START_TIME:.2f}s，耗时 {latency:.2f}s")
+
+    def get_status(self):
+        """
+        获取预热状态
+
+        Returns:
+            dict: 包含就绪状态、各步骤耗时以及首个快速响应时间
+        """
+        def since_start(timestamp):
+            if timestamp is None:
+                return None
+            return round(timestamp - PROCESS_START_TIME, 3)
+
+        return {
+            "ready": self.is_ready(),
+            "warmup_enabled": self.enabled,
+            "steps": list(self.step_results),
+            "time_to_ready": since_start(self.ready_at),
+            "fast_response_threshold": self.fast_response_threshold,
+            "time_to_first_fast_response": since_start(self.first_fast_response_at)
+        }
+
+def get_warmup_queries():
+    """
+    获取预热时执行的示例查询
+
+    Returns:
+        list: 查询列表，可通过WARMUP_QUERIES环境变量配置，多个查询用|分隔
+    """
+    queries = os.environ.get("WARMUP_QUERIES", "查询市盈率小于30倍，换手率大于10%的股票")
+    return [query.strip() for query in queries.split("|") if query.strip()]